@@ -1,2 +1,3 @@
-def main() -> None:
-    print("Hello from beanzero!")
+from beanzero.cli import main
+
+__all__ = ["main"]
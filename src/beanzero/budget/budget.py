@@ -3,7 +3,8 @@ from __future__ import annotations
 import datetime
 import functools
 import operator
-import os
+import threading
+import typing
 from collections import defaultdict
 from decimal import Decimal
 from pathlib import Path
@@ -13,7 +14,18 @@ import beancount.core.data as beandata
 import beancount.loader
 from attrs import define
 
-from beanzero.budget.core import BudgetTransaction, MonthlyTotals
+from beanzero.budget.cache import LedgerCache
+from beanzero.budget.core import MonthlyTotals
+from beanzero.budget.ledger import (
+    FileTransactions,
+    LedgerFile,
+    added_files,
+    extract_transactions,
+    group_by_month,
+    parse_ledger_file,
+    supports_incremental_reload,
+)
+from beanzero.budget.snapshot import BudgetSnapshot, write_snapshot
 from beanzero.budget.spec import (
     BudgetSpec,
     CategoryGroup,
@@ -21,7 +33,28 @@ from beanzero.budget.spec import (
     CategoryMap,
     Month,
 )
-from beanzero.budget.store import BudgetStore, get_store_converter
+from beanzero.budget.store import (
+    JOURNAL_COMPACT_RECORDS,
+    AmountEdit,
+    open_store,
+)
+
+# the files in the ledger, the budget transactions in each, whether it can be reloaded
+# incrementally, and its directives if they're being kept
+type LedgerContents = tuple[
+    list[LedgerFile], FileTransactions, bool, list[beandata.Directive] | None
+]
+
+
+def with_store_lock(method):
+    """Hold the budget's store lock for the duration of the method."""
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._store_lock:
+            return method(self, *args, **kwargs)
+
+    return locked
 
 
 class Budget:
@@ -31,73 +64,306 @@ class Budget:
     ledger, and the stored budget amounts from the data JSON file.
 
     Iterates over months to calculate per-category and overall balances and totals.
+
+    Only the budget-relevant data extracted from the ledger is kept. Pass
+    keep_directives to also hold on to the raw beancount directives, which are then
+    available as beancount_directives whenever the ledger is loaded in full.
+
+    The budget store may be saved from another thread, so every access to it goes
+    through the store lock.
+
+    Totals may also be recalculated from another thread, a month at a time. Each
+    recalculation supersedes any already in progress, and the months it doesn't get
+    to are remembered as stale, to be picked up by the next one.
     """
 
-    def __init__(self, spec_path: Path | str):
-        spec_path = Path(spec_path)
-        old_cwd = os.getcwd()
-        os.chdir(spec_path.parent)
-        with spec_path.relative_to(spec_path.parent).open("r") as spec_f:
-            self.spec = BudgetSpec.load(spec_f)
-        os.chdir(old_cwd)
+    def __init__(self, spec_path: Path | str, keep_directives: bool = False):
+        self._keep_directives = keep_directives
+        self._store_lock = threading.RLock()
+        # held for the whole of each reload, so they don't overlap
+        self._reload_lock = threading.Lock()
+        # bumped by every recalculation, so superseded ones know to stop
+        self._recalculation = 0
+        # the first month left stale by an unfinished recalculation, and the last month
+        # whose successor may not have been calculated from it
+        self._stale_from: Month | None = None
+        self._stale_through: Month | None = None
+        self.spec = BudgetSpec.load_path(spec_path)
+
+        # Serve totals straight from a fresh snapshot if we have one, until anything
+        # changes, otherwise load the beancount data, and convert and categorise
+        # transactions by month
+        self._snapshot: BudgetSnapshot | None = None
+        if self.spec.snapshot and (
+            snapshot := BudgetSnapshot.open_fresh(self.spec.snapshot, self.spec)
+        ):
+            self._snapshot = snapshot
+            self._ledger_files = {f.path: f for f in snapshot.ledger_files}
+            self._incremental = snapshot.incremental
+            self.beancount_directives = None
+        else:
+            self._load_ledger()
+
+        # Load our budget data store
+        # we want to keep the store private and expose methods on Budget to ensure
+        # we can re-run validation and refresh all the MonthlyTotals and so on as
+        # required
+        self._store = open_store(self.spec)
+        self._store.check_categories()
+
+        # Calculate monthly totals from transaction and budgeting data
+        self.monthly_totals: dict[Month, MonthlyTotals] | BudgetSnapshot
+        if self._snapshot is None:
+            self.monthly_totals = dict()
+            self.update_monthly_totals()
+        else:
+            self.monthly_totals = self._snapshot
+
+    def _load_ledger(self, use_cache: bool = True):
+        """Extract the budget transactions from every file in the ledger."""
+        self._use_ledger(*self._read_ledger(use_cache))
+
+    def _read_ledger(self, use_cache: bool = True) -> LedgerContents:
+        """Extract the budget transactions from every file in the ledger, without
+        touching the budget's own state, so this can run without the store lock.
+
+        Skips the beancount loader entirely if we have a fresh cache.
+        """
+        if (
+            use_cache
+            and self.spec.cache
+            and (cache := LedgerCache.load_fresh(self.spec.cache, self.spec))
+        ):
+            return cache.files, cache.transactions, cache.incremental, None
 
-        # Load the beancount data, and convert and categorise transactions by month
         directives, errors, options = beancount.loader.load_file(self.spec.ledger)
+        kept_directives = directives if self._keep_directives else None
+
+        files = [LedgerFile.from_path(path) for path in options["include"]]
+        incremental = supports_incremental_reload(directives, options)
+        file_transactions = extract_transactions(self.spec, directives)
+        # drop our reference so the directives can be freed as soon as we return
+        del directives
+
+        if self.spec.cache:
+            LedgerCache.from_transactions(
+                self.spec, files, file_transactions, incremental
+            ).save(self.spec.cache, self.spec)
+        return files, file_transactions, incremental, kept_directives
+
+    def _use_ledger(
+        self,
+        files: list[LedgerFile],
+        file_transactions: FileTransactions,
+        incremental: bool,
+        directives: list[beandata.Directive] | None,
+    ):
         self.beancount_directives = directives
+        self._incremental = incremental
+        self._ledger_files = {f.path: f for f in files}
+        self._file_transactions = {
+            path: group_by_month(txs) for path, txs in file_transactions.items()
+        }
 
-        self.monthly_transactions = defaultdict(list)
+        # built up before being swapped in, as other threads may be reading it
+        monthly_transactions = defaultdict(list)
+        for months in self._file_transactions.values():
+            for month, txs in months.items():
+                monthly_transactions[month].extend(txs)
+        self.monthly_transactions = monthly_transactions
 
-        for directive in directives:
-            if isinstance(directive, beandata.Transaction):
-                if tx := BudgetTransaction.from_beancount_tx(self.spec, directive):
-                    self.monthly_transactions[tx.month].append(tx)
+    def changed_ledger_files(self) -> list[Path]:
+        return [path for path, f in self._ledger_files.items() if not f.is_fresh()]
 
-        # Load our budget data store
-        if self.spec.storage.exists():
-            with self.spec.storage.open("r") as storage_f:
-                # we want to keep the store private and expose methods on Budget to ensure
-                # we can re-run validation and refresh all the MonthlyTotals and so on as
-                # required
-                self._store = BudgetStore.load(storage_f, self.spec)
+    def added_ledger_files(self) -> set[Path]:
+        """New files matching one of the ledger's include patterns."""
+        return added_files(list(self._ledger_files.values()))
+
+    def reload_ledger(self) -> Month | None:
+        """Pick up any changes to the files in the ledger's include tree.
+
+        Only the changed files are re-parsed where possible, and totals are only
+        recalculated from the earliest month whose transactions actually changed. The
+        ledger is reloaded in full whenever an include pattern matches a new file.
+
+        Files are parsed without holding the store lock, so this can run in another
+        thread while totals are read and amounts are edited.
+
+        Returns that month, or None if nothing changed.
+        """
+        with self._reload_lock:
+            changed = self.changed_ledger_files()
+            added = self.added_ledger_files()
+            if not changed and not added:
+                return None
+
+            reparsed = dict()
+            if self._incremental and self._snapshot is None and not added:
+                for path in changed:
+                    # record the file's identity before parsing, so any write racing
+                    # with us is picked up next time around
+                    try:
+                        ledger_file = LedgerFile.from_path(path)
+                    except OSError:
+                        break
+                    if (txs := parse_ledger_file(self.spec, path)) is None:
+                        break
+                    reparsed[path] = (ledger_file, group_by_month(txs))
+
+            ledger = None
+            if added or len(reparsed) != len(changed):
+                # only a snapshot's ledger can still be served from the cache
+                ledger = self._read_ledger(use_cache=self._snapshot is not None)
+
+            with self._store_lock:
+                return self._apply_reload(reparsed, ledger)
+
+    def _apply_reload(
+        self,
+        reparsed: dict[Path, tuple[LedgerFile, dict[Month, list]]],
+        ledger: LedgerContents | None,
+    ) -> Month | None:
+        if self._snapshot is not None:
+            self._load_in_full(ledger)
+            return self.ledger_start_month
+
+        old_transactions = dict(self.monthly_transactions)
+        if ledger is None:
+            affected = set()
+            for path, (ledger_file, months) in reparsed.items():
+                old_months = self._file_transactions.get(path, {})
+                affected |= {
+                    month
+                    for month in old_months.keys() | months.keys()
+                    if old_months.get(month) != months.get(month)
+                }
+                self._ledger_files[path] = ledger_file
+                self._file_transactions[path] = months
+
+            for month in affected:
+                self.monthly_transactions[month] = [
+                    tx
+                    for months in self._file_transactions.values()
+                    for tx in months.get(month, [])
+                ]
         else:
-            self._store = get_store_converter(self.spec).structure(
-                dict(assigned=dict()), BudgetStore
-            )
+            self._use_ledger(*ledger)
+            affected = {
+                month
+                for month in old_transactions.keys() | self.monthly_transactions.keys()
+                if old_transactions.get(month, []) != self.monthly_transactions[month]
+            }
 
-        for month, assignments in self._store.assigned.items():
-            for cat in assignments.categories.keys():
-                if cat not in self.spec.all_category_keys:
-                    raise ValueError(
-                        f"Budgeted amount for non-existent category '{cat}' found in {month}"
-                    )
+        for month in [m for m, txs in self.monthly_transactions.items() if not txs]:
+            del self.monthly_transactions[month]
+        if not affected:
+            return None
 
-        # Calculate monthly totals from transaction and budgeting data
-        self.monthly_totals: dict[Month, MonthlyTotals] = dict()
+        for month in [m for m in self.monthly_totals if m < self.ledger_start_month]:
+            del self.monthly_totals[month]
+        from_month = max(min(affected), self.ledger_start_month)
+        self.update_monthly_totals(from_month=from_month)
+        return from_month
+
+    @with_store_lock
+    def _load_in_full(self, ledger: LedgerContents | None = None):
+        """Stop serving totals from the snapshot, and calculate them from the ledger.
+
+        Pass the ledger if it's already been read.
+        """
+        if self._snapshot is None:
+            return
+
+        snapshot, self._snapshot = self._snapshot, None
+        self._use_ledger(*(ledger or self._read_ledger()))
+        self.monthly_totals = dict()
         self.update_monthly_totals()
+        snapshot.close()
+
+    def write_snapshot(self, path: Path | None = None):
+        """Write the totals for every month to a snapshot, by default the spec's."""
+        path = path or self.spec.snapshot
+        if path is None:
+            raise ValueError("No snapshot path given or set in the budget config")
+        write_snapshot(
+            path,
+            self.spec,
+            self.monthly_totals,
+            self.ledger_start_month,
+            self.latest_month,
+            self._ledger_files.values(),
+            self._incremental,
+        )
 
     @property
+    @with_store_lock
     def ledger_start_month(self):
+        if self._snapshot is not None:
+            return self._snapshot.start
         return min(self.monthly_transactions.keys())
 
     @property
+    @with_store_lock
     def latest_budget_month(self):
-        self._store.prune()
-        if len(self._store.assigned) > 0:
-            return max(self._store.assigned.keys())
-        else:
-            return Month.now()
+        return self._store.latest_month() or Month.now()
 
     @property
+    @with_store_lock
     def latest_month(self):
+        if self._snapshot is not None:
+            # checked against the current month when the snapshot was opened
+            return self._snapshot.end
         return max(
             Month.now() + 1,
             self.latest_budget_month + 1,
             max(self.monthly_transactions.keys()),
         )
 
-    def update_monthly_totals(self, from_month: Month | None = None):
-        month = from_month or self.ledger_start_month
-        while month <= self.latest_month:
+    @with_store_lock
+    def totals_for(self, month: Month) -> MonthlyTotals | None:
+        """The totals for a month if they've been calculated, from any thread."""
+        return self.monthly_totals.get(month)
+
+    @with_store_lock
+    def update_monthly_totals(
+        self, from_month: Month | None = None, settle: bool = False
+    ):
+        """Recalculate totals for every month from from_month onwards.
+
+        Pass settle if only from_month's own transactions or assignments have changed,
+        to stop as soon as a month carries the same amounts forward as it did before,
+        since no later month can then be affected.
+
+        Also catches up with any stale months, and supersedes any recalculation in
+        progress.
+        """
+        latest_month = self.latest_month
+        self._recalculation += 1
+        month = self._catch_up(from_month or self.ledger_start_month)
+        stale_through = self._stale_through
+        self._stale_from = self._stale_through = None
+
+        if self.spec.engine == "numpy":
+            # only import numpy if we need it, as it's an optional dependency
+            from beanzero.budget.vectorized import compute_monthly_totals
+
+            self.monthly_totals.update(
+                compute_monthly_totals(
+                    self.spec,
+                    self.monthly_transactions,
+                    self._store.assigned,
+                    month,
+                    latest_month,
+                    None
+                    if month == self.ledger_start_month
+                    else self.monthly_totals[month - 1],
+                )
+            )
+            return
+
+        settle = settle and latest_month in self.monthly_totals
+        while month <= latest_month:
+            old_totals = self.monthly_totals.get(month)
             if month == self.ledger_start_month:
                 self.monthly_totals[month] = MonthlyTotals.from_transactions(
                     self.spec,
@@ -113,18 +379,181 @@ class Budget:
                     self._store.assigned[month].categories,
                     prev_month=self.monthly_totals[month - 1],
                 )
+            if (
+                settle
+                and old_totals is not None
+                and (stale_through is None or month > stale_through)
+                and self.monthly_totals[month].carries_same_as(old_totals)
+            ):
+                break
+            month += 1
+
+    def _catch_up(self, from_month: Month) -> Month:
+        """Extend a recalculation from from_month to cover any stale months.
+
+        Returns the month to start from, and moves the stale-through month on so the
+        recalculation can't settle before reaching both the stale months and
+        from_month itself.
+        """
+        if self._stale_from is None:
+            return from_month
+
+        stale_through = max(self._stale_from, from_month) - 1
+        if self._stale_through is None or self._stale_through < stale_through:
+            self._stale_through = stale_through
+        return min(from_month, self._stale_from)
+
+    def recalculate(
+        self, from_month: Month, category: CategoryKey | None = None
+    ) -> typing.Iterator[Month]:
+        """Recalculate totals after a change to from_month's assigned amounts.
+
+        Yields each month once its totals are updated, starting with from_month, and
+        stops as soon as a month carries the same amounts forward as it did before.
+        Pass category if only that category's assigned amount has changed, to only
+        carry its own column and the global totals forward.
+
+        The store lock is only held for a month at a time, so this can run in another
+        thread while amounts are edited. Stopping iteration early leaves the rest of
+        the months stale, as does starting another recalculation, which then carries
+        on from where this one got to. The edited months are marked stale as soon as
+        this is called, even if iteration never starts.
+        """
+        with self._store_lock:
+            self._recalculation += 1
+            recalculation = self._recalculation
+            if self._stale_from is not None:
+                # the unfinished recalculation may have been for another category,
+                # so recalculate every category from where it got to
+                category = None
+            edited_month = from_month
+            from_month = self._catch_up(from_month)
+
+            latest_month = self.latest_month
+            if from_month < self.ledger_start_month or any(
+                month not in self.monthly_totals
+                for month in Month.range(from_month, latest_month)
+            ):
+                self.update_monthly_totals(from_month=from_month)
+                return iter(())
+            self._stale_from = from_month
+
+        return self._recalculate_months(
+            recalculation, from_month, latest_month, edited_month, category
+        )
+
+    def _recalculate_months(
+        self,
+        recalculation: int,
+        from_month: Month,
+        latest_month: Month,
+        edited_month: Month,
+        category: CategoryKey | None,
+    ) -> typing.Iterator[Month]:
+        month = from_month
+        while month <= latest_month:
+            with self._store_lock:
+                if recalculation != self._recalculation:
+                    return
+
+                prev_month = (
+                    None
+                    if month == self.ledger_start_month
+                    else self.monthly_totals[month - 1]
+                )
+                old_totals = self.monthly_totals[month]
+                if category is None:
+                    totals = MonthlyTotals.from_transactions(
+                        self.spec,
+                        self.monthly_transactions[month],
+                        self._store.assigned[month].held,
+                        self._store.assigned[month].categories,
+                        prev_month=prev_month,
+                    )
+                else:
+                    # only edited_month's assigned amount has changed
+                    totals = old_totals.with_category(
+                        category,
+                        prev_month,
+                        self.spec.to_units(
+                            self._store.assigned[month].categories[category]
+                        )
+                        if month == edited_month
+                        else None,
+                    )
+                self.monthly_totals[month] = totals
+
+                settled = (
+                    self._stale_through is None or month > self._stale_through
+                ) and totals.carries_same_as(old_totals)
+                if settled or month == latest_month:
+                    self._stale_from = self._stale_through = None
+                else:
+                    self._stale_from = month + 1
+
+            yield month
+            if settled:
+                return
             month += 1
 
+    def update_category_totals(self, from_month: Month, category: CategoryKey):
+        """Recalculate totals after a change to one category's assigned amount.
+
+        Only the category's own column and the global totals are carried forward, as
+        no other category's balances can be affected, and only until a month carries
+        the same amounts forward as it did before.
+        """
+        for _ in self.recalculate(from_month, category):
+            pass
+
+    @with_store_lock
+    def set_assigned_amount(
+        self, month: Month, category: CategoryKey, amount: amt.Amount
+    ):
+        """Change an assigned amount without recalculating or saving anything."""
+        self._load_in_full()
+        self._store.set_amount(month, category, amount)
+
+    @with_store_lock
+    def set_held_amount(self, month: Month, amount: amt.Amount):
+        """Change a held amount without recalculating or saving anything."""
+        self._load_in_full()
+        self._store.set_amount(month, None, amount)
+
+    @with_store_lock
     def update_assigned_amount(
         self, month: Month, category: CategoryKey, amount: amt.Amount, save: bool = True
     ):
-        self._store.assigned[month].categories[category] = amount
-        self.update_monthly_totals(from_month=month)
+        self.set_assigned_amount(month, category, amount)
+        self.update_category_totals(month, category)
         if save:
-            self._store.save(self.spec.storage, self.spec.zero)
+            self.journal_amounts([(month, category, amount)])
 
+    @with_store_lock
     def update_held_amount(self, month: Month, amount: amt.Amount, save: bool = True):
-        self._store.assigned[month].held = amount
-        self.update_monthly_totals(from_month=month)
+        self.set_held_amount(month, amount)
+        self.update_monthly_totals(from_month=month, settle=True)
         if save:
-            self._store.save(self.spec.storage, self.spec.zero)
+            self.journal_amounts([(month, None, amount)])
+
+    @with_store_lock
+    def journal_amounts(self, edits: list[AmountEdit]):
+        """Persist edits already made with save=False.
+
+        JSON stores append the edits to a journal, which is compacted into the saved
+        store once it grows long enough. SQLite stores write them straight to their
+        rows.
+        """
+        self._store.append_journal(self.spec.storage, edits)
+        if self._store.journal_records >= JOURNAL_COMPACT_RECORDS:
+            self.save()
+
+    @with_store_lock
+    def save(self):
+        """Save the budget store in full, compacting the journal of edits into it."""
+        self._store.save(self.spec.storage, self.spec)
+
+    def compact_journal(self):
+        """Save the budget store only if it has journalled edits to compact."""
+        if self._store.journal_records > 0:
+            self.save()
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import typing
+from pathlib import Path
+
+from attrs import define
+from cattrs import Converter
+from cattrs.errors import BaseValidationError
+
+from beanzero.budget.core import BudgetTransaction
+from beanzero.budget.ledger import LedgerFile, are_fresh
+from beanzero.budget.spec import BudgetSpec
+from beanzero.budget.store import get_store_converter
+
+# bump whenever the cached data format or extraction logic changes
+CACHE_VERSION = 4
+
+
+@define
+class LedgerCache:
+    """The budget transactions extracted from a ledger, persisted between runs.
+
+    Keyed on every file in the ledger's include tree, along with the include patterns
+    that pulled them in, and the spec's fingerprint, so a fresh cache can stand in for
+    running the beancount loader at all.
+    """
+
+    version: int
+    spec_fingerprint: str
+    files: list[LedgerFile]
+    transactions: dict[Path, list[BudgetTransaction]]
+    incremental: bool
+
+    @classmethod
+    def from_transactions(
+        cls,
+        spec: BudgetSpec,
+        files: typing.Iterable[LedgerFile],
+        transactions: dict[Path, list[BudgetTransaction]],
+        incremental: bool,
+    ) -> LedgerCache:
+        return cls(
+            CACHE_VERSION, spec.fingerprint, list(files), transactions, incremental
+        )
+
+    @classmethod
+    def load(cls, fp: typing.IO, spec: BudgetSpec) -> LedgerCache:
+        data = json.load(fp)
+        return get_cache_converter(spec).structure(data, cls)
+
+    @classmethod
+    def load_fresh(cls, path: Path, spec: BudgetSpec) -> LedgerCache | None:
+        """Load the cache at path, or return None if it's missing or out of date."""
+        try:
+            with path.open("r") as cache_f:
+                cache = cls.load(cache_f, spec)
+        except (OSError, ValueError, KeyError, TypeError, BaseValidationError):
+            return None
+
+        if cache.is_fresh(spec):
+            return cache
+        else:
+            return None
+
+    def is_fresh(self, spec: BudgetSpec) -> bool:
+        return (
+            self.version == CACHE_VERSION
+            and self.spec_fingerprint == spec.fingerprint
+            and are_fresh(self.files)
+        )
+
+    def save(self, path: Path, spec: BudgetSpec):
+        data = get_cache_converter(spec).unstructure(self)
+        tempfile = path.parent / f"{path.name}.write"
+        with tempfile.open("w") as write_f:
+            json.dump(data, write_f, separators=(",", ":"))
+        tempfile.rename(path)
+
+
+def get_cache_converter(spec: BudgetSpec) -> Converter:
+    # only built once for each spec, and then kept on it
+    if (cache_converter := spec.converters.get("cache")) is None:
+        cache_converter = spec.converters["cache"] = build_cache_converter(spec)
+    return cache_converter
+
+
+def build_cache_converter(spec: BudgetSpec) -> Converter:
+    # build on the store converter for amounts, months, and category maps
+    cache_converter = get_store_converter(spec).copy()
+
+    cache_converter.register_structure_hook(
+        datetime.date, lambda d, _: datetime.date.fromisoformat(d)
+    )
+    cache_converter.register_unstructure_hook(datetime.date, lambda d: d.isoformat())
+    cache_converter.register_structure_hook(Path, lambda p, _: Path(p))
+    cache_converter.register_unstructure_hook(Path, os.fspath)
+
+    # transactions are stored in minor units, writing out only the categories that
+    # were actually spent from
+    cache_converter.register_unstructure_hook(
+        BudgetTransaction,
+        lambda tx: {
+            "date": tx.date.isoformat(),
+            "flow": tx.flow_units,
+            "spending": tx.spending_units,
+        },
+    )
+
+    def structure_transaction(data: dict, _) -> BudgetTransaction:
+        spending = data["spending"]
+        for k, v in spending.items():
+            if k not in spec.category_slots or not isinstance(v, int):
+                raise ValueError(f"Invalid cached spending {k}: {v}")
+        if not isinstance(data["flow"], int):
+            raise ValueError(f"Invalid cached flow {data['flow']}")
+        return BudgetTransaction(
+            spec, datetime.date.fromisoformat(data["date"]), data["flow"], spending
+        )
+
+    cache_converter.register_structure_hook(BudgetTransaction, structure_transaction)
+
+    return cache_converter
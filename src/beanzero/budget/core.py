@@ -2,14 +2,52 @@ from __future__ import annotations
 
 import datetime
 import functools
-import operator
-from decimal import Decimal
 
 import beancount.core.amount as amt
 import beancount.core.data as beandata
-from attrs import define
+from attrs import Converter, define, field
 
-from beanzero.budget.spec import BudgetSpec, CategoryGroup, CategoryMap, Month
+from beanzero.budget.spec import (
+    BudgetSpec,
+    CategoryGroup,
+    CategoryKey,
+    CategoryMap,
+    Month,
+)
+
+type UnitsMap = dict[CategoryKey, int]
+
+
+def units_converter(value: amt.Amount | int, self) -> int:
+    return value if isinstance(value, int) else self.spec.to_units(value)
+
+
+def units_map_converter(values: CategoryMap | UnitsMap, self) -> UnitsMap:
+    # category maps hold amt.Amount values, anything else is already in units
+    if isinstance(values, CategoryMap):
+        return values.to_units()
+    return values
+
+
+def sparse_units_map_converter(values: CategoryMap | UnitsMap, self) -> UnitsMap:
+    return {k: v for k, v in units_map_converter(values, self).items() if v}
+
+
+def units_field(**kwargs):
+    """An integer field of minor units, that can be initialised with an amt.Amount."""
+    return field(converter=Converter(units_converter, takes_self=True), **kwargs)
+
+
+def units_map_field(**kwargs):
+    """A units map field, that can be initialised with a CategoryMap."""
+    return field(converter=Converter(units_map_converter, takes_self=True), **kwargs)
+
+
+def sparse_units_map_field(**kwargs):
+    """A units map field that only keeps its non-zero entries."""
+    return field(
+        converter=Converter(sparse_units_map_converter, takes_self=True), **kwargs
+    )
 
 
 @define(frozen=True)
@@ -19,23 +57,40 @@ class BudgetTransaction:
     Spending represents money leaving the budget, and so should be usually negative.
 
     Governed by the equation flow(+/-) = funding(+) + spending(-)
+
+    Amounts are held as integer minor units of the budget's currency, and only
+    converted to amt.Amount when read through the properties without a _units suffix.
+    Spending is held sparsely, with only the categories actually spent from.
     """
 
+    spec: BudgetSpec = field(eq=False, repr=False)
     date: datetime.date
-    flow: amt.Amount
-    spending: CategoryMap
+    flow_units: int = units_field(alias="flow")
+    spending_units: UnitsMap = sparse_units_map_field(alias="spending")
+
+    @property
+    def flow(self) -> amt.Amount:
+        return self.spec.from_units(self.flow_units)
+
+    @property
+    def spending(self) -> CategoryMap:
+        return CategoryMap.from_units(self.spec, self.spending_units)
 
     @functools.cached_property
+    def total_spending_units(self) -> int:
+        return sum(self.spending_units.values())
+
+    @property
     def total_spending(self) -> amt.Amount:
-        return functools.reduce(
-            amt.add,
-            self.spending.values(),
-            amt.Amount(Decimal("0"), self.flow.currency),
-        )
+        return self.spec.from_units(self.total_spending_units)
 
     @functools.cached_property
+    def funding_units(self) -> int:
+        return self.flow_units - self.total_spending_units
+
+    @property
     def funding(self) -> amt.Amount:
-        return amt.sub(self.flow, self.total_spending)
+        return self.spec.from_units(self.funding_units)
 
     @functools.cached_property
     def month(self) -> Month:
@@ -45,36 +100,41 @@ class BudgetTransaction:
     def from_beancount_tx(
         cls, spec: BudgetSpec, tx: beandata.Transaction
     ) -> BudgetTransaction | None:
-        # Scan through postings for overall budget flow
+        # Scan through postings for overall budget flow, noting any categorised
+        # postings on the way so we only need to classify each account once
         flow = spec.zero
-        budget_accounts = set()
+        category_postings = []
         for posting in tx.postings:
-            if spec.is_budget_acccount(posting.account):
+            role = spec.account_role(posting.account)
+            if role.budget_account:
                 if posting.units is None:
                     raise ValueError("Null posting")
-                budget_accounts.add(posting.account)
                 flow = amt.add(flow, posting.units)
+            if role.category is not None:
+                category_postings.append((role, posting))
 
         # If there's no net budget inflow or outflow, then this transaction isn't
-        # relevant to the budget
-        if flow == spec.zero:
+        # relevant to the budget. Postings may be more precise than the currency, so
+        # sums are only rounded to its minor units once they're complete
+        flow_units = spec.round_to_units(flow)
+        if flow_units == 0:
             return None
 
         # If there's flow, then calculate any spending
-        spending = spec.category_map()
-        for posting in tx.postings:
-            if cat := spec.get_account_category(posting.account):
-                if cat in budget_accounts:
-                    raise ValueError(
-                        f"Account {cat} cannot be budget account and budget category"
-                    )
-                if posting.units is None:
-                    raise ValueError("Null posting")
-
-                spending[cat] = amt.sub(spending[cat], posting.units)
-
-        btx = BudgetTransaction(tx.date, flow, spending)
-        if btx.funding < spec.zero:
+        spending_amounts: dict[CategoryKey, amt.Amount] = dict()
+        for role, posting in category_postings:
+            if posting.units is None:
+                raise ValueError("Null posting")
+
+            spending_amounts[role.category] = amt.sub(
+                spending_amounts.get(role.category, spec.zero), posting.units
+            )
+        spending: UnitsMap = {
+            key: spec.round_to_units(amount) for key, amount in spending_amounts.items()
+        }
+
+        btx = BudgetTransaction(spec, tx.date, flow_units, spending)
+        if btx.funding_units < 0:
             raise ValueError(f"Negative funding for transaction {tx}")
 
         return btx
@@ -87,35 +147,37 @@ class MonthlyTotals:
     Holding and budgeted amounts are usually positive.
     Funding is usually positive.
     Spending (including overspending) is usually negative.
+
+    All arithmetic is done on integer minor units of the budget's currency. Each
+    amount is available in units from the attribute with a _units suffix, and as an
+    amt.Amount or CategoryMap from the attribute without.
     """
 
     # governing spec
     spec: BudgetSpec
 
     # global amounts
-    previous_tba: amt.Amount
-    previous_holding: amt.Amount
-    previous_overspending: amt.Amount
-    funding: amt.Amount
-    holding: amt.Amount
+    previous_tba_units: int = units_field(alias="previous_tba")
+    previous_holding_units: int = units_field(alias="previous_holding")
+    previous_overspending_units: int = units_field(alias="previous_overspending")
+    funding_units: int = units_field(alias="funding")
+    holding_units: int = units_field(alias="holding")
 
     # per-category amounts
-    previous_carryover: CategoryMap
-    spending: CategoryMap
-    assigning: CategoryMap
+    previous_carryover_units: UnitsMap = units_map_field(alias="previous_carryover")
+    spending_units: UnitsMap = units_map_field(alias="spending")
+    assigning_units: UnitsMap = units_map_field(alias="assigning")
 
     @staticmethod
-    def aggregate_funding(spec: BudgetSpec, txs: list[BudgetTransaction]):
-        return functools.reduce(
-            amt.add, map(operator.attrgetter("funding"), txs), spec.zero
-        )
+    def aggregate_funding(spec: BudgetSpec, txs: list[BudgetTransaction]) -> int:
+        return sum(tx.funding_units for tx in txs)
 
     @staticmethod
-    def aggregate_spending(spec: BudgetSpec, txs: list[BudgetTransaction]):
-        spending = spec.category_map()
+    def aggregate_spending(spec: BudgetSpec, txs: list[BudgetTransaction]) -> UnitsMap:
+        spending = dict.fromkeys(spec.all_category_keys, 0)
         for tx in txs:
-            for k, v in tx.spending.items():
-                spending[k] = amt.add(spending[k], v)
+            for k, v in tx.spending_units.items():
+                spending[k] += v
         return spending
 
     @classmethod
@@ -128,15 +190,15 @@ class MonthlyTotals:
         prev_month: MonthlyTotals | None = None,
     ) -> MonthlyTotals:
         if prev_month is None:
-            previous_tba = spec.zero
-            previous_holding = spec.zero
-            previous_overspending = spec.zero
-            carryover = spec.category_map()
+            previous_tba = 0
+            previous_holding = 0
+            previous_overspending = 0
+            carryover = dict.fromkeys(spec.all_category_keys, 0)
         else:
-            previous_tba = prev_month.to_be_assigned
-            previous_holding = prev_month.holding
-            previous_overspending = prev_month.overspending
-            carryover = prev_month.carryover_balances
+            previous_tba = prev_month.to_be_assigned_units
+            previous_holding = prev_month.holding_units
+            previous_overspending = prev_month.overspending_units
+            carryover = prev_month.carryover_balances_units
         return MonthlyTotals(
             spec,
             previous_tba,
@@ -149,57 +211,183 @@ class MonthlyTotals:
             assigning,
         )
 
-    @property
+    # derived amounts, materialised once when the month is built
+    total_spending_units: int = field(init=False)
+    total_assigning_units: int = field(init=False)
+    category_balances_units: UnitsMap = field(init=False)
+    carryover_balances_units: UnitsMap = field(init=False)
+    overspending_units: int = field(init=False)
+    to_be_assigned_units: int = field(init=False)
+
+    def __attrs_post_init__(self):
+        carryover, spending, assigning = (
+            self.previous_carryover_units,
+            self.spending_units,
+            self.assigning_units,
+        )
+        balances = {k: carryover[k] + spending[k] + assigning[k] for k in carryover}
+        total_assigning = sum(assigning.values())
+        overspending = sum(v for v in balances.values() if v < 0)
+
+        object.__setattr__(self, "total_spending_units", sum(spending.values()))
+        object.__setattr__(self, "total_assigning_units", total_assigning)
+        object.__setattr__(self, "category_balances_units", balances)
+        object.__setattr__(
+            self,
+            "carryover_balances_units",
+            {k: max(v, 0) for k, v in balances.items()},
+        )
+        object.__setattr__(self, "overspending_units", overspending)
+        object.__setattr__(self, "to_be_assigned_units", self._calculate_tba())
+
+    def _calculate_tba(self) -> int:
+        return (
+            self.previous_tba_units
+            + self.previous_holding_units
+            + self.previous_overspending_units
+            + self.funding_units
+            - self.total_assigning_units
+            - self.holding_units
+        )
+
+    def carries_same_as(self, other: MonthlyTotals) -> bool:
+        """Whether these totals carry exactly the same amounts into the next month."""
+        return (
+            self.to_be_assigned_units == other.to_be_assigned_units
+            and self.holding_units == other.holding_units
+            and self.overspending_units == other.overspending_units
+            and self.carryover_balances_units == other.carryover_balances_units
+        )
+
+    def with_category(
+        self,
+        key: CategoryKey,
+        prev_month: MonthlyTotals | None,
+        assigning: int | None = None,
+    ) -> MonthlyTotals:
+        """Copy these totals after a change to a single category's column.
+
+        Picks up the category's carryover and the global amounts carried from
+        prev_month, and optionally a new assigned amount. Only that category's balances
+        and the global totals are recalculated; every other category's values are
+        reused as they are, and the spending map is shared outright.
+        """
+        if prev_month is None:
+            carryover, previous = 0, (0, 0, 0)
+        else:
+            carryover = prev_month.carryover_balances_units[key]
+            previous = (
+                prev_month.to_be_assigned_units,
+                prev_month.holding_units,
+                prev_month.overspending_units,
+            )
+        if assigning is None:
+            assigning = self.assigning_units[key]
+        old_balance = self.category_balances_units[key]
+        balance = carryover + self.spending_units[key] + assigning
+
+        # skip __init__ and fill in the fields directly, so the untouched columns
+        # don't need to go through conversion and materialisation again
+        totals = object.__new__(MonthlyTotals)
+        for name, value in (
+            ("spec", self.spec),
+            ("previous_tba_units", previous[0]),
+            ("previous_holding_units", previous[1]),
+            ("previous_overspending_units", previous[2]),
+            ("funding_units", self.funding_units),
+            ("holding_units", self.holding_units),
+            (
+                "previous_carryover_units",
+                self.previous_carryover_units | {key: carryover},
+            ),
+            ("spending_units", self.spending_units),
+            ("assigning_units", self.assigning_units | {key: assigning}),
+            ("total_spending_units", self.total_spending_units),
+            (
+                "total_assigning_units",
+                self.total_assigning_units - self.assigning_units[key] + assigning,
+            ),
+            ("category_balances_units", self.category_balances_units | {key: balance}),
+            (
+                "carryover_balances_units",
+                self.carryover_balances_units | {key: max(balance, 0)},
+            ),
+            (
+                "overspending_units",
+                self.overspending_units - min(old_balance, 0) + min(balance, 0),
+            ),
+        ):
+            object.__setattr__(totals, name, value)
+        object.__setattr__(totals, "to_be_assigned_units", totals._calculate_tba())
+        return totals
+
+    # amt.Amount and CategoryMap views are built on first access and then reused, so
+    # must be treated as read-only
+
+    @functools.cached_property
+    def previous_tba(self) -> amt.Amount:
+        return self.spec.from_units(self.previous_tba_units)
+
+    @functools.cached_property
+    def previous_holding(self) -> amt.Amount:
+        return self.spec.from_units(self.previous_holding_units)
+
+    @functools.cached_property
+    def previous_overspending(self) -> amt.Amount:
+        return self.spec.from_units(self.previous_overspending_units)
+
+    @functools.cached_property
+    def funding(self) -> amt.Amount:
+        return self.spec.from_units(self.funding_units)
+
+    @functools.cached_property
+    def holding(self) -> amt.Amount:
+        return self.spec.from_units(self.holding_units)
+
+    @functools.cached_property
+    def previous_carryover(self) -> CategoryMap:
+        return CategoryMap.from_units(self.spec, self.previous_carryover_units)
+
+    @functools.cached_property
+    def spending(self) -> CategoryMap:
+        return CategoryMap.from_units(self.spec, self.spending_units)
+
+    @functools.cached_property
+    def assigning(self) -> CategoryMap:
+        return CategoryMap.from_units(self.spec, self.assigning_units)
+
+    @functools.cached_property
     def total_spending(self) -> amt.Amount:
-        return functools.reduce(amt.add, self.spending.values(), self.spec.zero)
+        return self.spec.from_units(self.total_spending_units)
 
-    @property
+    @functools.cached_property
     def total_assigning(self) -> amt.Amount:
-        return functools.reduce(amt.add, self.assigning.values(), self.spec.zero)
+        return self.spec.from_units(self.total_assigning_units)
 
-    @property
+    @functools.cached_property
     def category_balances(self) -> CategoryMap:
-        balances = self.spec.category_map()
-        for key in self.spec.all_category_keys:
-            balances[key] = self.previous_carryover[key]
-            balances[key] = amt.add(balances[key], self.spending[key])
-            balances[key] = amt.add(balances[key], self.assigning[key])
-        return balances
+        return CategoryMap.from_units(self.spec, self.category_balances_units)
 
-    @property
+    @functools.cached_property
     def carryover_balances(self) -> CategoryMap:
-        balances = self.category_balances.copy()
-        for k, v in balances.items():
-            if v.number and v.number < 0:
-                balances[k] = self.spec.zero
-
-        return balances
+        return CategoryMap.from_units(self.spec, self.carryover_balances_units)
 
-    @property
+    @functools.cached_property
     def overspending(self) -> amt.Amount:
-        balances = self.category_balances
-        neg_balances = [a for a in balances.values() if a.number < 0]  # type: ignore
-        overspending = functools.reduce(amt.add, neg_balances, self.spec.zero)
-        return overspending
+        return self.spec.from_units(self.overspending_units)
 
-    @property
+    @functools.cached_property
     def to_be_assigned(self) -> amt.Amount:
-        tba = self.previous_tba
-        tba = amt.add(tba, self.previous_holding)
-        tba = amt.add(tba, self.previous_overspending)
-        tba = amt.add(tba, self.funding)
-        tba = amt.sub(tba, self.total_assigning)
-        tba = amt.sub(tba, self.holding)
-        return tba
+        return self.spec.from_units(self.to_be_assigned_units)
 
     def group_assigned(self, group: CategoryGroup) -> amt.Amount:
-        amounts = [self.assigning[cat.key] for cat in group.categories]
-        return functools.reduce(amt.add, amounts, self.spec.zero)
+        units = sum(self.assigning_units[cat.key] for cat in group.categories)
+        return self.spec.from_units(units)
 
     def group_spending(self, group: CategoryGroup) -> amt.Amount:
-        amounts = [self.spending[cat.key] for cat in group.categories]
-        return functools.reduce(amt.add, amounts, self.spec.zero)
+        units = sum(self.spending_units[cat.key] for cat in group.categories)
+        return self.spec.from_units(units)
 
     def group_balance(self, group: CategoryGroup) -> amt.Amount:
-        amounts = [self.category_balances[cat.key] for cat in group.categories]
-        return functools.reduce(amt.add, amounts, self.spec.zero)
+        units = sum(self.category_balances_units[cat.key] for cat in group.categories)
+        return self.spec.from_units(units)
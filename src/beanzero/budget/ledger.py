@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import re
+import typing
+from collections import defaultdict
+from pathlib import Path
+
+import beancount.core.data as beandata
+from attrs import define, field
+from beancount.parser import booking, parser
+
+from beanzero.budget.core import BudgetTransaction
+from beanzero.budget.spec import BudgetSpec, Month
+
+type FileTransactions = dict[Path, list[BudgetTransaction]]
+
+# an include directive, which beancount only accepts at the start of a line
+INCLUDE_PATTERN = re.compile(rb'^include[ \t]+"([^"\n]*)"', re.MULTILINE)
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@define(frozen=True)
+class LedgerFile:
+    """The identity of a single file in the ledger's include tree."""
+
+    path: Path
+    size: int
+    mtime_ns: int
+    sha256: str
+    # the absolute glob patterns of the files this one includes
+    includes: tuple[str, ...] = field(default=(), converter=tuple)
+
+    @classmethod
+    def from_path(cls, path: Path | str) -> LedgerFile:
+        path = Path(path)
+        stat = path.stat()
+        contents = path.read_bytes()
+        includes = [
+            os.path.join(path.parent, os.fsdecode(pattern))
+            for pattern in INCLUDE_PATTERN.findall(contents)
+        ]
+        return cls(
+            path,
+            stat.st_size,
+            stat.st_mtime_ns,
+            hashlib.sha256(contents).hexdigest(),
+            includes,
+        )
+
+    def is_fresh(self) -> bool:
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return False
+
+        if stat.st_size != self.size:
+            return False
+        elif stat.st_mtime_ns == self.mtime_ns:
+            return True
+        else:
+            # touched but possibly not changed, so fall back to the content hash
+            return file_sha256(self.path) == self.sha256
+
+
+def expand_includes(files: typing.Iterable[LedgerFile]) -> set[Path]:
+    """Every file matched by the include patterns of files, as beancount expands them."""
+    return {
+        Path(os.path.normpath(matched))
+        for f in files
+        for pattern in f.includes
+        for matched in glob.glob(pattern, recursive=True)
+    }
+
+
+def added_files(files: typing.Collection[LedgerFile]) -> set[Path]:
+    """Files that now match an include pattern of files, but aren't among them."""
+    return expand_includes(files) - {f.path for f in files}
+
+
+def are_fresh(files: typing.Collection[LedgerFile]) -> bool:
+    """Whether none of files have changed, and no new files have been included."""
+    return (
+        len(files) > 0 and all(f.is_fresh() for f in files) and not added_files(files)
+    )
+
+
+def iter_budget_transactions(
+    spec: BudgetSpec, directives: typing.Iterable[beandata.Directive]
+) -> typing.Iterator[tuple[Path, BudgetTransaction]]:
+    """Lazily convert beancount transactions to budget transactions.
+
+    Each budget transaction is yielded along with the file it came from. Directives
+    are consumed one at a time and not referenced afterwards, so nothing but the
+    budget-relevant data needs to outlive the source directives.
+    """
+    for directive in directives:
+        if isinstance(directive, beandata.Transaction):
+            if tx := BudgetTransaction.from_beancount_tx(spec, directive):
+                yield Path(directive.meta.get("filename", "")), tx
+
+
+def extract_transactions(
+    spec: BudgetSpec, directives: typing.Iterable[beandata.Directive]
+) -> FileTransactions:
+    """Convert beancount transactions to budget transactions, grouped by source file."""
+    transactions: FileTransactions = defaultdict(list)
+    for path, tx in iter_budget_transactions(spec, directives):
+        transactions[path].append(tx)
+    return dict(transactions)
+
+
+def supports_incremental_reload(
+    directives: typing.Iterable[beandata.Directive], options: dict
+) -> bool:
+    """Whether files in this ledger can be re-parsed in isolation.
+
+    Plugins and pad directives can synthesise transactions from entries spread across
+    several files, so any ledger using them is always reloaded in full.
+    """
+    if options["plugin"]:
+        return False
+    return not any(isinstance(d, beandata.Pad) for d in directives)
+
+
+def parse_ledger_file(spec: BudgetSpec, path: Path) -> list[BudgetTransaction] | None:
+    """Extract the budget transactions from a single ledger file in isolation.
+
+    Returns None if the file can't be understood without loading the whole ledger,
+    e.g. because it includes other files or doesn't book cleanly by itself.
+    """
+    entries, errors, options = parser.parse_file(str(path))
+    if (
+        errors
+        or options["include"]
+        or not supports_incremental_reload(entries, options)
+    ):
+        return None
+
+    entries, errors = booking.book(entries, options)
+    if errors:
+        return None
+
+    entries.sort(key=beandata.entry_sortkey)
+    return extract_transactions(spec, entries).get(path, [])
+
+
+def group_by_month(
+    transactions: typing.Iterable[BudgetTransaction],
+) -> dict[Month, list[BudgetTransaction]]:
+    months = defaultdict(list)
+    for tx in transactions:
+        months[tx.month].append(tx)
+    return dict(months)
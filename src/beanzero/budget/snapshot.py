@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import json
+import mmap
+import struct
+import typing
+from collections.abc import Mapping
+from pathlib import Path
+
+from beanzero.budget.core import MonthlyTotals
+from beanzero.budget.ledger import LedgerFile, are_fresh
+from beanzero.budget.spec import BudgetSpec, Month
+from beanzero.budget.store import store_files
+
+SNAPSHOT_MAGIC = b"BEANZERO"
+
+# bump whenever the snapshot layout or the calculations behind it change
+SNAPSHOT_VERSION = 3
+
+# magic, version, number of months, number of categories, first month, metadata length
+HEADER = struct.Struct("<8sIIIiI")
+
+# the amounts each month's totals are built from, in minor units - any derived amounts
+# are materialised by MonthlyTotals as each month is read
+SCALARS = (
+    "previous_tba_units",
+    "previous_holding_units",
+    "previous_overspending_units",
+    "funding_units",
+    "holding_units",
+)
+COLUMNS = ("previous_carryover_units", "spending_units", "assigning_units")
+
+
+def record_struct(n_categories: int) -> struct.Struct:
+    return struct.Struct(f"<{len(SCALARS) + len(COLUMNS) * n_categories}q")
+
+
+def file_identity(path: Path) -> LedgerFile | None:
+    return LedgerFile.from_path(path) if path.exists() else None
+
+
+def is_identity_fresh(path: Path, f: LedgerFile | None) -> bool:
+    return not path.exists() if f is None else f.is_fresh()
+
+
+def identity_to_data(f: LedgerFile | None) -> list | None:
+    if f is None:
+        return None
+    return [str(f.path), f.size, f.mtime_ns, f.sha256, list(f.includes)]
+
+
+def identity_from_data(data: list | None) -> LedgerFile | None:
+    return None if data is None else LedgerFile(Path(data[0]), *data[1:])
+
+
+def write_snapshot(
+    path: Path,
+    spec: BudgetSpec,
+    monthly_totals: Mapping[Month, MonthlyTotals],
+    start: Month,
+    end: Month,
+    ledger_files: typing.Iterable[LedgerFile],
+    incremental: bool,
+):
+    """Write the totals for every month from start to end into a snapshot at path.
+
+    The snapshot is keyed on the spec's fingerprint and the identities of every
+    ledger and store file, along with the include patterns in each ledger file, so
+    that it can be checked for freshness without reading any of them.
+    """
+    keys = spec.all_category_keys
+    metadata = json.dumps(
+        {
+            "spec_fingerprint": spec.fingerprint,
+            "categories": keys,
+            "ledger_files": [identity_to_data(f) for f in ledger_files],
+            "store_files": {
+                str(p): identity_to_data(file_identity(p)) for p in store_files(spec)
+            },
+            "incremental": incremental,
+        },
+        separators=(",", ":"),
+    ).encode()
+    # keep the month records 8-byte aligned
+    metadata += b" " * (-(HEADER.size + len(metadata)) % 8)
+
+    n_months = end - start + 1
+    record = record_struct(len(keys))
+    tempfile = path.parent / f"{path.name}.write"
+    with tempfile.open("wb") as write_f:
+        write_f.write(
+            HEADER.pack(
+                SNAPSHOT_MAGIC,
+                SNAPSHOT_VERSION,
+                n_months,
+                len(keys),
+                start.ordinal,
+                len(metadata),
+            )
+        )
+        write_f.write(metadata)
+        for month in Month.range(start, end):
+            totals = monthly_totals[month]
+            values = [getattr(totals, name) for name in SCALARS]
+            for name in COLUMNS:
+                column = getattr(totals, name)
+                values.extend(column[key] for key in keys)
+            write_f.write(record.pack(*values))
+    tempfile.rename(path)
+
+
+class BudgetSnapshot(Mapping[Month, MonthlyTotals]):
+    """Computed monthly totals, read lazily from a memory-mapped snapshot file.
+
+    Each month's totals are only unpacked the first time they're accessed.
+    """
+
+    def __init__(self, path: Path, spec: BudgetSpec):
+        self.spec = spec
+        with path.open("rb") as snapshot_f:
+            self._mmap = mmap.mmap(snapshot_f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, n_months, n_categories, start, metadata_size = (
+                HEADER.unpack_from(self._mmap)
+            )
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a budget snapshot")
+            self.version = version
+            self.start = Month.from_ordinal(start)
+            self.end = self.start + (n_months - 1)
+            self._metadata = json.loads(
+                self._mmap[HEADER.size : HEADER.size + metadata_size]
+            )
+            self._offset = HEADER.size + metadata_size
+            self._record = record_struct(n_categories)
+            if len(self._mmap) != self._offset + n_months * self._record.size:
+                raise ValueError(f"Snapshot {path} is truncated")
+        except Exception:
+            self.close()
+            raise
+
+        self.ledger_files = [
+            identity_from_data(f) for f in self._metadata["ledger_files"]
+        ]
+        self.incremental = self._metadata["incremental"]
+        self._totals: dict[Month, MonthlyTotals] = dict()
+
+    @classmethod
+    def open_fresh(cls, path: Path, spec: BudgetSpec) -> BudgetSnapshot | None:
+        """Open the snapshot at path, or return None if it's missing or out of date."""
+        try:
+            snapshot = cls(path, spec)
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            return None
+
+        if snapshot.is_fresh():
+            return snapshot
+        else:
+            snapshot.close()
+            return None
+
+    def is_fresh(self) -> bool:
+        saved_store_files = {
+            Path(p): identity_from_data(f)
+            for p, f in self._metadata["store_files"].items()
+        }
+        return (
+            self.version == SNAPSHOT_VERSION
+            and self._metadata["spec_fingerprint"] == self.spec.fingerprint
+            and self._metadata["categories"] == self.spec.all_category_keys
+            and are_fresh(self.ledger_files)
+            and saved_store_files.keys() == set(store_files(self.spec))
+            and all(is_identity_fresh(p, f) for p, f in saved_store_files.items())
+            # the budget always runs to at least next month
+            and Month.now() + 1 <= self.end
+        )
+
+    def close(self):
+        self._mmap.close()
+
+    def __getitem__(self, month: Month) -> MonthlyTotals:
+        if (totals := self._totals.get(month)) is not None:
+            return totals
+        if not self.start <= month <= self.end:
+            raise KeyError(month)
+
+        values = self._record.unpack_from(
+            self._mmap, self._offset + (month - self.start) * self._record.size
+        )
+        keys = self.spec.all_category_keys
+        n_scalars, n_categories = len(SCALARS), len(keys)
+        columns = [
+            dict(zip(keys, values[i : i + n_categories]))
+            for i in range(n_scalars, len(values), n_categories)
+        ]
+        totals = self._totals[month] = MonthlyTotals(
+            self.spec, *values[:n_scalars], *columns
+        )
+        return totals
+
+    def __iter__(self) -> typing.Iterator[Month]:
+        return Month.range(self.start, self.end)
+
+    def __len__(self) -> int:
+        return self.end - self.start + 1
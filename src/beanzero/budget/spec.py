@@ -1,10 +1,15 @@
 from __future__ import annotations
 
 import datetime
+import fnmatch
+import functools
+import hashlib
+import json
 import locale
+import os
 import typing
+from collections.abc import MutableMapping
 from decimal import Decimal
-from functools import total_ordering
 from pathlib import Path
 
 import babel
@@ -12,29 +17,48 @@ import babel.numbers
 import beancount.core.amount as amt
 import beancount.core.data as beandata
 import yaml
-from attrs import define, field
+from attrs import converters, define, field, validators
 from cattrs import Converter
 from slugify import slugify
 
 spec_converter = Converter()
 
 
-@total_ordering
-@define(frozen=True)
 class Month:
-    """Represents a month of a given year."""
+    """Represents a month of a given year.
+
+    Months are backed by a single ordinal counting from January of year 0, and are
+    interned, so there is only ever one instance of each month. Arithmetic, hashing
+    and comparison all work on the ordinal.
+    """
+
+    __slots__ = ("ordinal", "month", "year")
+    _interned: dict[int, Month] = dict()
 
-    month: int = field()
-    year: int = field()
+    ordinal: int
+    month: int
+    year: int
 
-    @month.validator  # type: ignore
-    def check_month(self, attribute, month: int):
+    def __new__(cls, month: int, year: int) -> Month:
         if not 1 <= month <= 12:
             raise ValueError("Month must be between 1 and 12")
+        return cls.from_ordinal(12 * year + month - 1)
+
+    @classmethod
+    def from_ordinal(cls, ordinal: int) -> Month:
+        try:
+            return cls._interned[ordinal]
+        except KeyError:
+            pass
+        month = object.__new__(cls)
+        object.__setattr__(month, "ordinal", ordinal)
+        object.__setattr__(month, "month", ordinal % 12 + 1)
+        object.__setattr__(month, "year", ordinal // 12)
+        return cls._interned.setdefault(ordinal, month)
 
     @classmethod
     def from_datetime(cls, in_datetime: datetime.datetime | datetime.date):
-        return Month(in_datetime.month, in_datetime.year)
+        return cls.from_ordinal(12 * in_datetime.year + in_datetime.month - 1)
 
     @classmethod
     def from_string(cls, string: str):
@@ -43,29 +67,53 @@ class Month:
 
     @classmethod
     def now(cls):
-        now = datetime.datetime.today()
-        return Month(now.month, now.year)
+        return cls.from_datetime(datetime.datetime.today())
+
+    @classmethod
+    def range(cls, start: Month, end: Month) -> typing.Iterator[Month]:
+        """Iterate over every month from start to end inclusive."""
+        return map(cls.from_ordinal, range(start.ordinal, end.ordinal + 1))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Can't set {name}, months are immutable")
+
+    def __reduce__(self):
+        # keep months interned through pickling and copying
+        return (Month.from_ordinal, (self.ordinal,))
 
     def __add__(self, months: int) -> Month:
-        new_month = self.month + months - 1
-        new_year = self.year
-        if new_month >= 12 or new_month < 0:
-            new_year += new_month // 12
-            new_month = new_month % 12
-        return Month(new_month + 1, new_year)
+        return Month.from_ordinal(self.ordinal + months)
 
     def __sub__(self, other: int | Month) -> int | Month:
         if isinstance(other, int):
-            return self + (-other)
+            return Month.from_ordinal(self.ordinal - other)
         elif isinstance(other, Month):
-            return 12 * (self.year - other.year) + self.month - other.month
+            return self.ordinal - other.ordinal
         else:
             raise ValueError
 
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Month):
+            return NotImplemented
+        return self.ordinal == other.ordinal
+
+    def __hash__(self) -> int:
+        return hash(self.ordinal)
+
     def __lt__(self, other: Month) -> bool:
-        return self.year < other.year or (
-            self.year == other.year and self.month < other.month
-        )
+        return self.ordinal < other.ordinal
+
+    def __le__(self, other: Month) -> bool:
+        return self.ordinal <= other.ordinal
+
+    def __gt__(self, other: Month) -> bool:
+        return self.ordinal > other.ordinal
+
+    def __ge__(self, other: Month) -> bool:
+        return self.ordinal >= other.ordinal
+
+    def __repr__(self):
+        return f"Month(month={self.month}, year={self.year})"
 
     def start_datetime(self):
         return datetime.datetime(year=self.year, month=self.month, day=1)
@@ -88,15 +136,112 @@ def parse_month(val: str, _) -> Month:
     return Month.from_string(val)
 
 
+def is_glob(component: str) -> bool:
+    return any(c in component for c in "*?[")
+
+
+def components_overlap(a: str, b: str) -> bool:
+    """Whether any single account component could match both a and b."""
+    if not is_glob(a) and not is_glob(b):
+        return a == b
+    elif not is_glob(a):
+        return fnmatch.fnmatchcase(a, b)
+    elif not is_glob(b):
+        return fnmatch.fnmatchcase(b, a)
+
+    # for two globs, compare the literal text before the first and after the last
+    # wildcard - this is exact for simple globs like Car* or *-Fees, and otherwise
+    # errs on the side of reporting an overlap
+    def literal_ends(glob: str) -> tuple[str, str]:
+        wildcards = [i for i, c in enumerate(glob) if c in "*?[]"]
+        return glob[: wildcards[0]], glob[wildcards[-1] + 1 :]
+
+    a_start, a_end = literal_ends(a)
+    b_start, b_end = literal_ends(b)
+    return (a_start.startswith(b_start) or b_start.startswith(a_start)) and (
+        a_end.endswith(b_end) or b_end.endswith(a_end)
+    )
+
+
+def patterns_overlap(a: str, b: str) -> bool:
+    """Whether any account could match both account patterns a and b."""
+    # patterns cover all descendant accounts, so only the shared depth matters
+    return all(components_overlap(x, y) for x, y in zip(a.split(":"), b.split(":")))
+
+
+class AccountTrie:
+    """Matches beancount accounts against a set of hierarchical account patterns.
+
+    Patterns are split into account components, each of which is either a literal
+    name or a glob matched against a single component. A pattern covers the accounts
+    it names and all of their descendants, so Expenses:Car covers Expenses:Car:Petrol.
+
+    Matching walks the trie one account component at a time, so the cost depends on
+    the depth of the account rather than the number of patterns.
+    """
+
+    __slots__ = ("children", "globs", "values")
+
+    def __init__(self):
+        self.children: dict[str, AccountTrie] = dict()
+        self.globs: list[tuple[str, AccountTrie]] = []
+        self.values: list = []
+
+    def add(self, pattern: str, value):
+        node = self
+        for component in pattern.split(":"):
+            if not is_glob(component):
+                node = node.children.setdefault(component, AccountTrie())
+                continue
+            for glob, child in node.globs:
+                if glob == component:
+                    node = child
+                    break
+            else:
+                child = AccountTrie()
+                node.globs.append((component, child))
+                node = child
+        node.values.append(value)
+
+    def match(self, account: str) -> list:
+        """Get the values of all patterns that cover the account."""
+        matches = []
+        nodes = [self]
+        for component in account.split(":"):
+            next_nodes = []
+            for node in nodes:
+                if (child := node.children.get(component)) is not None:
+                    next_nodes.append(child)
+                for glob, child in node.globs:
+                    if fnmatch.fnmatchcase(component, glob):
+                        next_nodes.append(child)
+            if not next_nodes:
+                break
+            for node in next_nodes:
+                matches.extend(node.values)
+            nodes = next_nodes
+        return matches
+
+
 @define(frozen=True)
 class BeanAccountCollection:
-    """Represents an aribtrary collection of Beancount accounts."""
+    """Represents an aribtrary collection of Beancount accounts.
+
+    Accounts are given as patterns, which may be globs, and cover all their
+    descendants - see AccountTrie.
+    """
 
     accounts: list[beandata.Account] = field(factory=list)
+    _trie: AccountTrie = field(init=False, eq=False, repr=False)
+
+    def __attrs_post_init__(self):
+        trie = AccountTrie()
+        for pattern in self.accounts:
+            trie.add(pattern, pattern)
+        object.__setattr__(self, "_trie", trie)
 
     def __contains__(self, account: str):
-        # TODO support globs
-        return account in self.accounts
+        return len(self._trie.match(account)) > 0
 
 
 @spec_converter.register_structure_hook
@@ -132,10 +277,26 @@ class CategoryGroup:
     categories: list[Category]
 
 
-class CategoryMap(dict):
+@define(frozen=True)
+class AccountRole:
+    """How postings to a particular beancount account are treated by a budget."""
+
+    budget_account: bool = False
+    category: CategoryKey | None = None
+
+
+class CategoryMap(MutableMapping[CategoryKey, amt.Amount]):
+    """Maps every category in a budget to an amount, which defaults to zero.
+
+    Values are held in a fixed-length list indexed by the spec's category slots, so
+    categories can be set but never added or removed.
+    """
+
+    __slots__ = ("_spec", "_values")
+
     def __init__(self, spec: BudgetSpec):
         self._spec = spec
-        return super().__init__({k: spec.zero for k in self._spec.all_category_keys})
+        self._values = [spec.zero] * len(spec.category_slots)
 
     @classmethod
     def with_values(cls, spec: BudgetSpec, init_values: dict = {}):
@@ -144,23 +305,114 @@ class CategoryMap(dict):
             d[k] = v
         return d
 
+    @classmethod
+    def from_units(cls, spec: BudgetSpec, units: dict[CategoryKey, int]):
+        d = cls(spec)
+        # units are keyed by category already, so skip the per-item checks
+        for k, v in units.items():
+            d._values[spec.category_slots[k]] = spec.from_units(v)
+        return d
+
+    def _slot(self, key) -> int:
+        try:
+            return self._spec.category_slots[key]
+        except KeyError:
+            raise KeyError(f"Illegal category key {key}") from None
+
     def __getitem__(self, key):
-        if key not in self._spec.all_category_keys:
-            raise KeyError(f"Illegal category key {key}")
-        else:
-            return super().__getitem__(key)
+        return self._values[self._slot(key)]
 
     def __setitem__(self, key, value):
-        if key not in self._spec.all_category_keys:
-            raise KeyError(f"Illegal category key {key}")
-        elif not isinstance(value, amt.Amount):
+        slot = self._slot(key)
+        if not isinstance(value, amt.Amount):
             raise ValueError(
                 f"Category values must be amt.Amount, not {value.__class__}"
             )
         elif value.currency != self._spec.currency:
             raise ValueError(f"Trying to set illegal currency {value.currency}")
         else:
-            super().__setitem__(key, value)
+            self._values[slot] = value
+
+    def __delitem__(self, key):
+        raise TypeError("Categories can't be removed from a CategoryMap")
+
+    def __contains__(self, key) -> bool:
+        return key in self._spec.category_slots
+
+    def __iter__(self) -> typing.Iterator[CategoryKey]:
+        return iter(self._spec.all_category_keys)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f"CategoryMap({dict(self.items())!r})"
+
+    def to_units(self) -> dict[CategoryKey, int]:
+        to_units = self._spec.to_units
+        return {
+            k: to_units(v) for k, v in zip(self._spec.all_category_keys, self._values)
+        }
+
+
+# the available implementations for calculating monthly totals - numpy requires the
+# optional numpy dependency
+ENGINES = ("python", "numpy")
+
+STORAGE_LAYOUTS = ("single", "yearly")
+
+# how the TUI lays out the category table - virtual only draws the visible rows
+TABLE_LAYOUTS = ("widgets", "virtual")
+
+# how many formatted amounts each currency formatter remembers
+FORMAT_CACHE_SIZE = 4096
+
+
+class CurrencyFormatter:
+    """Formats amounts of a single currency, for a single locale.
+
+    The locale and the currency pattern are resolved once up front, and recently
+    formatted numbers are kept in a bounded LRU cache, so formatting the same amounts
+    over and over again is cheap.
+    """
+
+    def __init__(
+        self,
+        currency: str,
+        currency_locale: str | None,
+        cache_size: int = FORMAT_CACHE_SIZE,
+    ):
+        self.currency = currency
+        self.precision = babel.numbers.get_currency_precision(currency)
+        self.locale = babel.Locale.parse(currency_locale or babel.numbers.LC_MONETARY)
+        self.pattern = self.locale.currency_formats["standard"]
+        self.format_number = functools.lru_cache(maxsize=cache_size)(
+            self._format_number
+        )
+
+    def _format_number(self, number: Decimal, signed: bool, with_symbol: bool) -> str:
+        return self.pattern.apply(
+            number,
+            self.locale,
+            currency=self.currency if with_symbol else "",
+            currency_digits=True,
+            decimal_quantization=False,
+        )
+
+    def __call__(self, amount: amt.Amount, symbol_override: bool | None = None) -> str:
+        if amount.number is None:
+            raise ValueError
+
+        if -amount.number.as_tuple().exponent > self.precision:
+            raise ValueError(f"Precision of {amount} exceeds {self.currency} precision")
+
+        # -0 and 0 are equal, with equal hashes, but are formatted differently, so
+        # the sign is part of the cache key too
+        return self.format_number(
+            amount.number,
+            amount.number.is_signed(),
+            symbol_override is None or symbol_override,
+        )
 
 
 @define(frozen=True)
@@ -180,6 +432,50 @@ class BudgetSpec:
     name: str | None = field(default=None)
     locale: str | None = field(default=None)
     theme: str | None = field(default=None)
+    cache: Path | None = field(
+        default=None, converter=converters.optional(Path.resolve)
+    )
+    engine: str = field(default="python", validator=validators.in_(ENGINES))
+    storage_layout: str = field(
+        default="single", validator=validators.in_(STORAGE_LAYOUTS)
+    )
+    table_layout: str = field(
+        default="widgets", validator=validators.in_(TABLE_LAYOUTS)
+    )
+    snapshot: Path | None = field(
+        default=None, converter=converters.optional(Path.resolve)
+    )
+    _category_trie: AccountTrie = field(
+        init=False, factory=AccountTrie, eq=False, repr=False
+    )
+    _account_roles: dict[str, AccountRole] = field(
+        init=False, factory=dict, eq=False, repr=False
+    )
+    # the converters other modules build for this spec, by what they convert
+    converters: dict[str, Converter] = field(
+        init=False, factory=dict, eq=False, repr=False
+    )
+    _category_keys: list[CategoryKey] = field(init=False, eq=False, repr=False)
+    category_slots: dict[CategoryKey, int] = field(init=False, eq=False, repr=False)
+
+    def __attrs_post_init__(self):
+        # fix the position of each category, for array-backed maps and tables
+        keys = [c.key for g in self.groups for c in g.categories]
+        object.__setattr__(self, "_category_keys", keys)
+        object.__setattr__(self, "category_slots", {k: i for i, k in enumerate(keys)})
+
+        named_accounts = set(self.accounts.accounts)
+        for group in self.groups:
+            for category in group.categories:
+                for pattern in category.accounts.accounts:
+                    self._category_trie.add(pattern, category.key)
+                    named_accounts.add(pattern)
+
+        # resolve the roles of every account named in the spec up front, so that
+        # classifying a posting is usually a single dict lookup
+        for account in named_accounts:
+            if not is_glob(account):
+                self._account_roles[account] = self._classify_account(account)
 
     @classmethod
     def load(cls, fp: typing.IO):
@@ -187,6 +483,18 @@ class BudgetSpec:
         spec = spec_converter.structure(data, cls)
         return spec
 
+    @classmethod
+    def load_path(cls, spec_path: Path | str) -> BudgetSpec:
+        """Load the spec at spec_path, with paths in it relative to its directory."""
+        spec_path = Path(spec_path)
+        old_cwd = os.getcwd()
+        os.chdir(spec_path.parent)
+        try:
+            with spec_path.relative_to(spec_path.parent).open("r") as spec_f:
+                return cls.load(spec_f)
+        finally:
+            os.chdir(old_cwd)
+
     @ledger.validator  # type: ignore
     def check_ledger(self, _, ledger):
         assert self.ledger.exists()
@@ -201,69 +509,117 @@ class BudgetSpec:
                     raise ValueError(f"Duplicate category key {category.key}")
                 keys.add(category.key)
 
-    @property
+    @groups.validator  # type: ignore
+    def check_account_overlaps(self, _, groups: list[CategoryGroup]):
+        # ensure no account could ever be classified two different ways
+        patterns = [
+            (pattern, category.key)
+            for group in groups
+            for category in group.categories
+            for pattern in category.accounts.accounts
+        ]
+        for i, (pattern, key) in enumerate(patterns):
+            for budget_pattern in self.accounts.accounts:
+                if patterns_overlap(pattern, budget_pattern):
+                    raise ValueError(
+                        f"Accounts matching {pattern} and {budget_pattern} cannot be budget accounts and in category {key}"
+                    )
+            for other_pattern, other_key in patterns[i + 1 :]:
+                if other_key != key and patterns_overlap(pattern, other_pattern):
+                    raise ValueError(
+                        f"Accounts matching {pattern} and {other_pattern} fit in multiple categories: {key} and {other_key}"
+                    )
+
+    @functools.cached_property
     def zero(self):
         return amt.Amount(Decimal("0"), self.currency)
 
     @property
-    def all_category_keys(self):
-        return [c.key for g in self.groups for c in g.categories]
+    def all_category_keys(self) -> list[CategoryKey]:
+        return self._category_keys
+
+    @property
+    def fingerprint(self) -> str:
+        """A hash of everything in the spec that affects transaction extraction."""
+        data = {
+            "currency": self.currency,
+            "accounts": self.accounts.accounts,
+            "groups": [
+                [[c.key, c.accounts.accounts] for c in g.categories]
+                for g in self.groups
+            ],
+        }
+        return hashlib.sha256(json.dumps(data).encode()).hexdigest()
 
     def category_map(self) -> CategoryMap:
         return CategoryMap(self)
 
-    # @functools.cache
+    def _classify_account(self, beancount_account: str) -> AccountRole:
+        # overlaps are rejected when loading, so there's at most one category
+        categories = self._category_trie.match(beancount_account)
+        return AccountRole(
+            beancount_account in self.accounts,
+            categories[0] if categories else None,
+        )
+
+    def account_role(self, beancount_account: str) -> AccountRole:
+        """Look up the role of an account, memoising any we haven't seen before."""
+        try:
+            return self._account_roles[beancount_account]
+        except KeyError:
+            role = self._classify_account(beancount_account)
+            self._account_roles[beancount_account] = role
+            return role
+
     def is_budget_acccount(self, beancount_account: str) -> bool:
-        return beancount_account in self.accounts
+        return self.account_role(beancount_account).budget_account
 
-    # @functools.cache
     def get_account_category(self, beancount_account: str) -> CategoryKey | None:
-        found_category_key: CategoryKey | None = None
+        return self.account_role(beancount_account).category
 
-        for group in self.groups:
-            for category in group.categories:
-                if beancount_account in category.accounts:
-                    if found_category_key is None:
-                        found_category_key = category.key
-                    else:
-                        raise ValueError(
-                            f"Account {beancount_account} fits in multiple categories: {found_category_key} and {category.key}"
-                        )
-
-        return found_category_key
+    @functools.cached_property
+    def precision(self) -> int:
+        return babel.numbers.get_currency_precision(self.currency)
 
     def is_amount_suitable_precision(self, amount: amt.Amount) -> bool:
-        precision = babel.numbers.get_currency_precision(self.currency)
-        return -amount.number.as_tuple().exponent <= precision
+        return -amount.number.as_tuple().exponent <= self.precision
+
+    def to_units(self, amount: amt.Amount) -> int:
+        """Convert an amount to a whole number of the currency's minor units."""
+        if amount.currency != self.currency:
+            raise ValueError(f"Can't convert {amount} to {self.currency} units")
+        units = amount.number.scaleb(self.precision)
+        if units != units.to_integral_value():
+            raise ValueError(f"Precision of {amount} exceeds {self.currency} precision")
+        return int(units)
 
-    def format_currency(
-        self, amount: amt.Amount, symbol_override: bool | None = None
-    ) -> str:
-        # TODO specify additional settings
+    def round_to_units(self, amount: amt.Amount) -> int:
+        """Convert an amount to the nearest whole number of the currency's minor units.
 
-        if amount.number is None:
-            raise ValueError
+        For amounts from the ledger, which may be more precise than the currency.
+        """
+        if amount.currency != self.currency:
+            raise ValueError(f"Can't convert {amount} to {self.currency} units")
+        return int(amount.number.scaleb(self.precision).to_integral_value())
 
-        if not self.is_amount_suitable_precision(amount):
-            raise ValueError(f"Precision of {amount} exceeds {self.currency} precision")
+    def from_units(self, units: int) -> amt.Amount:
+        return amt.Amount(Decimal(units).scaleb(-self.precision), self.currency)
 
-        currency_locale = (
+    @functools.cached_property
+    def currency_formatter(self) -> CurrencyFormatter:
+        # the system locale is only looked up the first time we format anything
+        return CurrencyFormatter(
+            self.currency,
             self.locale
             or locale.getlocale(locale.LC_MONETARY)[0]
-            or locale.getlocale()[0]
+            or locale.getlocale()[0],
         )
 
-        if symbol_override is not None and not symbol_override:
-            currency = ""
-        else:
-            currency = self.currency
-
-        return babel.numbers.format_currency(
-            amount.number,
-            currency,
-            locale=currency_locale,
-            decimal_quantization=False,
-        )
+    def format_currency(
+        self, amount: amt.Amount, symbol_override: bool | None = None
+    ) -> str:
+        # TODO specify additional settings
+        return self.currency_formatter(amount, symbol_override)
 
     @property
     def text_locale(self) -> babel.Locale:
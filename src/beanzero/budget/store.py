@@ -1,9 +1,11 @@
 from __future__ import annotations
 
-import copy
+import glob
 import json
+import sqlite3
 import typing
 from collections import defaultdict
+from collections.abc import MutableMapping
 from decimal import Decimal
 from pathlib import Path
 
@@ -21,6 +23,84 @@ from beanzero.budget.spec import (
     spec_converter,
 )
 
+# compact the journal into the stored snapshot once it holds this many edits
+JOURNAL_COMPACT_RECORDS = 256
+# clean year shards kept loaded, beyond those with unsaved edits
+SHARD_CACHE_SIZE = 2
+
+
+# a month, the category or None for the held amount, and the new amount
+type AmountEdit = tuple[Month, CategoryKey | None, amt.Amount]
+
+
+def journal_path(path: Path) -> Path:
+    """The journal of edits made since the store at path was last saved."""
+    return path.parent / f"{path.name}.journal"
+
+
+def write_journal(path: Path, edits: typing.Iterable[AmountEdit]) -> int:
+    """Append edits to the journal for the store at path, returning how many."""
+    lines = [
+        json.dumps(
+            {
+                "month": month.as_iso(),
+                "category": category,
+                "amount": str(amount.number),
+            },
+            separators=(",", ":"),
+        )
+        + "\n"
+        for month, category, amount in edits
+    ]
+    with journal_path(path).open("a") as journal_f:
+        journal_f.write("".join(lines))
+    return len(lines)
+
+
+def read_journal(path: Path, spec: BudgetSpec) -> typing.Iterator[AmountEdit]:
+    """Read back every edit in the journal for the store at path, in order.
+
+    Raises ValueError if any record but the last is malformed, or is for a category
+    that isn't in the spec.
+    """
+    try:
+        journal_f = journal_path(path).open("r+b")
+    except FileNotFoundError:
+        return
+
+    with journal_f:
+        lines = journal_f.readlines()
+        offset = 0
+        for number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+                month = Month.from_string(record["month"])
+                category = record["category"]
+                amount = amt.Amount(Decimal(record["amount"]), spec.currency)
+            except (ValueError, TypeError, KeyError, ArithmeticError) as error:
+                if number < len(lines):
+                    raise ValueError(
+                        f"Malformed record on line {number} of {journal_f.name}"
+                    ) from error
+                # a torn write from an interrupted session can only be the final
+                # line, and was never applied, so drop it before appending more
+                journal_f.truncate(offset)
+                break
+
+            if category is not None and category not in spec.category_slots:
+                raise ValueError(
+                    f"Journalled amount for non-existent category '{category}' "
+                    f"found in {month}"
+                )
+            yield month, category, amount
+            offset += len(line)
+        else:
+            if lines and not lines[-1].endswith(b"\n"):
+                # a write cut off just before its newline still left a complete
+                # record, so end its line before anything more is appended to it
+                journal_f.seek(offset)
+                journal_f.write(b"\n")
+
 
 @define
 class AssignedAmounts:
@@ -31,6 +111,11 @@ class AssignedAmounts:
     def validate_held(self, attr, held):
         assert held.number >= 0, "Can't have negative held balance"
 
+    def is_empty(self) -> bool:
+        return not self.held.number and not any(
+            v.number for v in self.categories.values()
+        )
+
 
 @define
 class BudgetStore:
@@ -42,42 +127,508 @@ class BudgetStore:
 
     assigned: defaultdict[Month, AssignedAmounts]
     spec: BudgetSpec = field(init=False)
+    journal_records: int = field(init=False, default=0)
 
     @classmethod
     def load(cls, fp: typing.IO, spec: BudgetSpec) -> BudgetStore:
         data = json.load(fp)
+        # category maps can only hold the spec's categories, so catch any others
+        # before structuring
+        for month, assignments in data.get("assigned", {}).items():
+            for cat in assignments.get("categories", {}):
+                if cat not in spec.category_slots:
+                    raise ValueError(
+                        f"Budgeted amount for non-existent category '{cat}' "
+                        f"found in {month}"
+                    )
         store = get_store_converter(spec).structure(data, cls)
         store.spec = spec
         return store
 
+    @classmethod
+    def empty(cls, spec: BudgetSpec) -> BudgetStore:
+        store = get_store_converter(spec).structure(dict(assigned=dict()), cls)
+        store.spec = spec
+        return store
+
+    def latest_month(self) -> Month | None:
+        """The latest month with any amounts assigned or held."""
+        self.prune()
+        return max(self.assigned.keys(), default=None)
+
+    def check_categories(self):
+        for month, assignments in self.assigned.items():
+            for cat in assignments.categories.keys():
+                if cat not in self.spec.category_slots:
+                    raise ValueError(
+                        f"Budgeted amount for non-existent category '{cat}' "
+                        f"found in {month}"
+                    )
+
     def prune(self):
         # Delete empty months
-        for months in list(self.assigned.keys()):
-            if self.assigned[months] == AssignedAmounts(
-                self.spec.zero, self.spec.category_map()
-            ):
-                del self.assigned[months]
+        for month, amounts in list(self.assigned.items()):
+            if amounts.is_empty():
+                del self.assigned[month]
+
+    def set_amount(
+        self, month: Month, category: CategoryKey | None, amount: amt.Amount
+    ):
+        """Set the amount assigned to a category, or held if category is None."""
+        if category is None:
+            self.assigned[month].held = amount
+        else:
+            self.assigned[month].categories[category] = amount
+
+    def append_journal(self, path: Path, edits: typing.Iterable[AmountEdit]):
+        """Record edits in the journal for the store at path, in a single write.
+
+        Much cheaper than saving the whole store, which can be left until the journal
+        is compacted by the next save.
+        """
+        self.journal_records += write_journal(path, edits)
+
+    def replay_journal(self, path: Path):
+        """Apply any edits journalled since the store at path was last saved."""
+        for month, category, amount in read_journal(path, self.spec):
+            self.set_amount(month, category, amount)
+            self.journal_records += 1
 
     def save(self, path: Path, spec: BudgetSpec):
-        # TODO sort on save & test roundtrips
         self.prune()
 
-        # remove zeroes from the data to write
-        write = copy.deepcopy(self)
-        for amounts in write.assigned.values():
-            for category in list(amounts.categories.keys()):
-                if amounts.categories[category] == self.spec.zero:
-                    del amounts.categories[category]
-        data = get_store_converter(spec).unstructure(write)
+        # written straight from the live store, as the converter skips zeroes
+        data = get_store_converter(spec).unstructure(self)
         tempfile = path.parent / f"{path.name}.write"
         with tempfile.open("w") as write_f:
             json.dump(data, write_f, indent=2)
         tempfile.rename(path)
 
+        # everything in the journal is now in the saved store
+        journal_path(path).unlink(missing_ok=True)
+        self.journal_records = 0
+
+
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS held (
+    month TEXT NOT NULL PRIMARY KEY,
+    amount TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS assigned (
+    month TEXT NOT NULL,
+    category TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    PRIMARY KEY (month, category)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteAssignedMonths(MutableMapping[Month, AssignedAmounts]):
+    """Assigned amounts by month, only read from the database as each is accessed.
+
+    Like the defaultdict of the JSON store, accessing a missing month gives empty
+    amounts. Iteration and membership only cover months with non-zero amounts, taking
+    the loaded months as they are, whether or not their edits have been saved yet.
+    """
+
+    def __init__(self, store: SqliteBudgetStore):
+        self._store = store
+        self._loaded: dict[Month, AssignedAmounts] = dict()
+
+    def __getitem__(self, month: Month) -> AssignedAmounts:
+        if (amounts := self._loaded.get(month)) is None:
+            amounts = self._loaded[month] = self._store.load_month(month)
+        return amounts
+
+    def __setitem__(self, month: Month, amounts: AssignedAmounts):
+        self._loaded[month] = amounts
+
+    def __delitem__(self, month: Month):
+        self._loaded.pop(month, None)
+        self._store.delete_month(month)
+
+    def __contains__(self, month: object) -> bool:
+        if not isinstance(month, Month):
+            return False
+        elif (amounts := self._loaded.get(month)) is not None:
+            return not amounts.is_empty()
+        else:
+            return month in self._store.saved_months()
+
+    def __iter__(self) -> typing.Iterator[Month]:
+        return iter(sorted(self.months()))
+
+    def __len__(self) -> int:
+        return len(self.months())
+
+    def months(self) -> set[Month]:
+        """Every month with non-zero amounts, saved or not."""
+        months = {m for m in self._store.saved_months() if m not in self._loaded}
+        months.update(
+            m for m, amounts in self._loaded.items() if not amounts.is_empty()
+        )
+        return months
+
+    @property
+    def loaded(self) -> dict[Month, AssignedAmounts]:
+        return self._loaded
+
+
+class SqliteBudgetStore:
+    """A budget store kept in SQLite, with a row for each non-zero amount.
+
+    Months are only loaded as they're accessed, and edits are written straight to
+    their rows in a transaction, so there's no journal to replay or compact.
+    """
+
+    journal_records = 0
+
+    def __init__(self, path: Path, spec: BudgetSpec):
+        self.spec = spec
+        # the budget serialises access with its own lock, so the connection can be
+        # shared with a background saving thread
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(SQLITE_SCHEMA)
+        # the months with rows saved, only queried again after the next write
+        self._saved_months: frozenset[Month] | None = None
+        self.assigned = SqliteAssignedMonths(self)
+
+    def amount(self, value: str) -> amt.Amount:
+        return amt.Amount(Decimal(value), self.spec.currency)
+
+    def saved_months(self) -> frozenset[Month]:
+        if self._saved_months is None:
+            rows = self._connection.execute(
+                "SELECT month FROM held UNION SELECT month FROM assigned"
+            )
+            self._saved_months = frozenset(Month.from_string(m) for (m,) in rows)
+        return self._saved_months
+
+    def latest_month(self) -> Month | None:
+        """The latest month with any amounts assigned or held, saved or not."""
+        return max(self.assigned.months(), default=None)
+
+    def load_month(self, month: Month) -> AssignedAmounts:
+        key = month.as_iso()
+        held = self._connection.execute(
+            "SELECT amount FROM held WHERE month = ?", (key,)
+        ).fetchone()
+        categories = self.spec.category_map()
+        for category, value in self._connection.execute(
+            "SELECT category, amount FROM assigned WHERE month = ?", (key,)
+        ):
+            if category not in categories:
+                raise ValueError(
+                    f"Budgeted amount for non-existent category '{category}' "
+                    f"found in {month}"
+                )
+            categories[category] = self.amount(value)
+        return AssignedAmounts(
+            self.spec.zero if held is None else self.amount(held[0]), categories
+        )
+
+    def delete_month(self, month: Month):
+        self._saved_months = None
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM held WHERE month = ?", (month.as_iso(),)
+            )
+            self._connection.execute(
+                "DELETE FROM assigned WHERE month = ?", (month.as_iso(),)
+            )
+
+    def check_categories(self):
+        keys = self.spec.all_category_keys
+        row = self._connection.execute(
+            "SELECT month, category FROM assigned "
+            f"WHERE category NOT IN ({', '.join('?' for _ in keys)}) LIMIT 1",
+            keys,
+        ).fetchone()
+        if row is not None:
+            month, category = row
+            raise ValueError(
+                f"Budgeted amount for non-existent category '{category}' found in "
+                f"{Month.from_string(month)}"
+            )
+
+    def prune(self):
+        # zero amounts are never saved, so there are no empty months to delete
+        pass
+
+    def set_amount(
+        self, month: Month, category: CategoryKey | None, amount: amt.Amount
+    ):
+        """Set the amount assigned to a category, or held if category is None."""
+        if category is None:
+            self.assigned[month].held = amount
+        else:
+            self.assigned[month].categories[category] = amount
+
+    def _write_amount(
+        self, month: Month, category: CategoryKey | None, amount: amt.Amount
+    ):
+        self._saved_months = None
+        if category is None:
+            if amount.number:
+                self._connection.execute(
+                    "INSERT INTO held VALUES (?, ?) "
+                    "ON CONFLICT (month) DO UPDATE SET amount = excluded.amount",
+                    (month.as_iso(), str(amount.number)),
+                )
+            else:
+                self._connection.execute(
+                    "DELETE FROM held WHERE month = ?", (month.as_iso(),)
+                )
+        elif amount.number:
+            self._connection.execute(
+                "INSERT INTO assigned VALUES (?, ?, ?) "
+                "ON CONFLICT (month, category) DO UPDATE SET amount = excluded.amount",
+                (month.as_iso(), category, str(amount.number)),
+            )
+        else:
+            self._connection.execute(
+                "DELETE FROM assigned WHERE month = ? AND category = ?",
+                (month.as_iso(), category),
+            )
+
+    def append_journal(self, path: Path, edits: typing.Iterable[AmountEdit]):
+        """Write edits to their rows, all in a single transaction."""
+        with self._connection:
+            for month, category, amount in edits:
+                self._write_amount(month, category, amount)
+
+    def replay_journal(self, path: Path):
+        pass
+
+    def save(self, path: Path, spec: BudgetSpec):
+        """Write every loaded month out in full, in a single transaction."""
+        with self._connection:
+            for month, amounts in self.assigned.loaded.items():
+                self._write_amount(month, None, amounts.held)
+                for category, amount in amounts.categories.items():
+                    self._write_amount(month, category, amount)
+
+    def close(self):
+        self._connection.close()
+
+
+class ShardedAssignedMonths(MutableMapping[Month, AssignedAmounts]):
+    """Assigned amounts by month, with each year's shard only loaded once accessed.
+
+    Like the defaultdict of the JSON store, accessing a missing month gives empty
+    amounts. Iterating loads every shard.
+    """
+
+    def __init__(self, store: ShardedBudgetStore):
+        self._store = store
+
+    def __getitem__(self, month: Month) -> AssignedAmounts:
+        return self._store.shard(month.year).assigned[month]
+
+    def __setitem__(self, month: Month, amounts: AssignedAmounts):
+        self._store.shard(month.year).assigned[month] = amounts
+        self._store.dirty.add(month.year)
+
+    def __delitem__(self, month: Month):
+        del self._store.shard(month.year).assigned[month]
+        self._store.dirty.add(month.year)
+
+    def __contains__(self, month: object) -> bool:
+        return (
+            isinstance(month, Month)
+            and month.year in self._store.years
+            and month in self._store.shard(month.year).assigned
+        )
+
+    def __iter__(self) -> typing.Iterator[Month]:
+        for year in sorted(self._store.years):
+            yield from sorted(self._store.shard(year).assigned.keys())
+
+    def __len__(self) -> int:
+        return sum(len(self._store.shard(year).assigned) for year in self._store.years)
+
+
+class ShardedBudgetStore:
+    """A JSON budget store split into a file for each year, next to the storage path.
+
+    Each year's shard is only loaded on first access to one of its months, and only
+    the most recently loaded shards are kept, along with any with unsaved edits, so
+    walking the whole history doesn't hold every year at once. Saving only writes back
+    the shards that have changed. Edits are journalled next to the
+    storage path, just as for the single-file store.
+    """
+
+    def __init__(self, path: Path, spec: BudgetSpec):
+        self.path = path
+        self.spec = spec
+        self.journal_records = 0
+        self.shards: dict[int, BudgetStore] = dict()
+        self.dirty: set[int] = set()
+        self.years = {
+            int(shard.suffixes[-2][1:])
+            for shard in path.parent.glob(
+                f"{glob.escape(path.stem)}.[0-9][0-9][0-9][0-9]{path.suffix}"
+            )
+        }
+        self.assigned = ShardedAssignedMonths(self)
+
+    def shard_path(self, year: int) -> Path:
+        return shard_path(self.path, year)
+
+    def shard(self, year: int) -> BudgetStore:
+        if (store := self.shards.get(year)) is not None:
+            return store
+
+        path = self.shard_path(year)
+        if year in self.years and path.exists():
+            with path.open("r") as shard_f:
+                store = BudgetStore.load(shard_f, self.spec)
+            for month in store.assigned.keys():
+                if month.year != year:
+                    raise ValueError(f"Month {month} found in the shard for {year}")
+            store.check_categories()
+        else:
+            store = BudgetStore.empty(self.spec)
+            self.years.add(year)
+
+        # drop the oldest clean shards, which can be loaded again if needed
+        clean = [y for y in self.shards if y not in self.dirty]
+        for evicted in clean[: len(self.shards) + 1 - SHARD_CACHE_SIZE]:
+            del self.shards[evicted]
+        self.shards[year] = store
+        return store
+
+    def latest_month(self) -> Month | None:
+        """The latest month with any amounts assigned or held."""
+        for year in sorted(self.years, reverse=True):
+            if (latest := self.shard(year).latest_month()) is not None:
+                return latest
+        return None
+
+    def check_categories(self):
+        # shards are checked as they're loaded
+        pass
+
+    def prune(self):
+        for store in self.shards.values():
+            store.prune()
+
+    def set_amount(
+        self, month: Month, category: CategoryKey | None, amount: amt.Amount
+    ):
+        """Set the amount assigned to a category, or held if category is None."""
+        self.shard(month.year).set_amount(month, category, amount)
+        self.dirty.add(month.year)
+
+    def append_journal(self, path: Path, edits: typing.Iterable[AmountEdit]):
+        """Record edits in the journal for the store at path, in a single write."""
+        self.journal_records += write_journal(path, edits)
+
+    def replay_journal(self, path: Path):
+        """Apply any edits journalled since the store at path was last saved."""
+        for month, category, amount in read_journal(path, self.spec):
+            self.set_amount(month, category, amount)
+            self.journal_records += 1
+
+    def save(self, path: Path, spec: BudgetSpec):
+        """Write back every shard that has changed, compacting the journal into them."""
+        self.save_shards(spec)
+        journal_path(path).unlink(missing_ok=True)
+        self.journal_records = 0
+
+    def save_shards(self, spec: BudgetSpec):
+        for year in sorted(self.dirty):
+            # empty shards are still written, as once there are no shards at all the
+            # original single-file store would be split up again
+            self.shards[year].save(self.shard_path(year), spec)
+        self.dirty.clear()
+
+
+def shard_path(path: Path, year: int) -> Path:
+    """The shard holding a year of the sharded store at path."""
+    return path.with_name(f"{path.stem}.{year}{path.suffix}")
+
+
+def store_files(spec: BudgetSpec) -> list[Path]:
+    """Every file the spec's budget store may currently be read from."""
+    if spec.storage_layout == "yearly":
+        store = ShardedBudgetStore(spec.storage, spec)
+        files = [store.shard_path(year) for year in sorted(store.years)]
+    else:
+        files = [spec.storage]
+    return files + [journal_path(spec.storage)]
+
+
+def open_store(
+    spec: BudgetSpec, path: Path | None = None
+) -> BudgetStore | SqliteBudgetStore | ShardedBudgetStore:
+    """Open the budget store at path, or the spec's storage by default.
+
+    SQLite is used for paths with one of the SQLITE_SUFFIXES, and JSON otherwise,
+    split into a file per year if the spec's storage_layout is yearly. A new, empty
+    store is returned if nothing exists at path yet.
+
+    Note the yearly layout ignores the file at path itself, other than to split it up
+    into shards when there are none yet.
+    """
+    path = spec.storage if path is None else path
+    if path.suffix in SQLITE_SUFFIXES:
+        return SqliteBudgetStore(path, spec)
+
+    store: BudgetStore | ShardedBudgetStore
+    if spec.storage_layout == "yearly":
+        store = ShardedBudgetStore(path, spec)
+        if not store.years and path.exists():
+            # split up an existing single-file store the first time it's used, which
+            # leaves the original file in place but no longer read
+            with path.open("r") as storage_f:
+                single = BudgetStore.load(storage_f, spec)
+            single.check_categories()
+            for month, amounts in single.assigned.items():
+                store.assigned[month] = amounts
+            store.save_shards(spec)
+    elif path.exists():
+        with path.open("r") as storage_f:
+            store = BudgetStore.load(storage_f, spec)
+    else:
+        store = BudgetStore.empty(spec)
+    store.replay_journal(path)
+    return store
+
+
+def migrate_store(spec: BudgetSpec, source: Path, dest: Path):
+    """Copy every assigned amount in the store at source to a new store at dest.
+
+    Stores can be migrated between JSON and SQLite in either direction, as decided by
+    each path's extension.
+    """
+    if dest.exists():
+        raise ValueError(f"Can't migrate to {dest} as it already exists")
+
+    source_store = open_store(spec, source)
+    source_store.check_categories()
+    dest_store = open_store(spec, dest)
+    for month in list(source_store.assigned.keys()):
+        dest_store.assigned[month] = source_store.assigned[month]
+    dest_store.save(dest, spec)
+
 
 # we need a function rather than a global instance as the hooks need the
 # currency-specific zero amt.Amount and category keys for a particular budget
 def get_store_converter(spec: BudgetSpec) -> Converter:
+    """Get the budget store converter for a spec.
+
+    The converter is only built once for each spec, and then kept on it, so copy it
+    before registering any more hooks.
+    """
+    if (store_converter := spec.converters.get("store")) is None:
+        store_converter = spec.converters["store"] = build_store_converter(spec)
+    return store_converter
+
+
+def build_store_converter(spec: BudgetSpec) -> Converter:
     # build on spec_converter for built-in month etc conversion
     store_converter = spec_converter.copy()
 
@@ -90,9 +641,9 @@ def get_store_converter(spec: BudgetSpec) -> Converter:
 
     @store_converter.register_structure_hook
     def structure_category(d, cls) -> CategoryMap:
-        out = spec.category_map()
-        out.update({k: amt.Amount(beancount.D(v), spec.currency) for k, v in d.items()})
-        return out
+        return CategoryMap.with_values(
+            spec, {k: amt.Amount(beancount.D(v), spec.currency) for k, v in d.items()}
+        )
 
     hook = defaultdict_structure_factory(
         defaultdict[Month, AssignedAmounts],
@@ -101,4 +652,20 @@ def get_store_converter(spec: BudgetSpec) -> Converter:
     )
     store_converter.register_structure_hook_func(is_defaultdict, hook)
 
+    # only write out the non-zero categories, and months in order
+    store_converter.register_unstructure_hook(
+        CategoryMap, lambda m: {k: str(v.number) for k, v in m.items() if v.number}
+    )
+    store_converter.register_unstructure_hook(
+        BudgetStore,
+        lambda store: {
+            "assigned": {
+                month.as_iso(): store_converter.unstructure(
+                    store.assigned[month], AssignedAmounts
+                )
+                for month in sorted(store.assigned.keys())
+            }
+        },
+    )
+
     return store_converter
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import typing
+
+import numpy as np
+
+from beanzero.budget.core import BudgetTransaction, MonthlyTotals
+from beanzero.budget.spec import BudgetSpec, Month
+
+if typing.TYPE_CHECKING:
+    from beanzero.budget.store import AssignedAmounts
+
+
+def compute_monthly_totals(
+    spec: BudgetSpec,
+    monthly_transactions: typing.Mapping[Month, list[BudgetTransaction]],
+    assigned: typing.Mapping[Month, AssignedAmounts],
+    start: Month,
+    end: Month,
+    prev_month: MonthlyTotals | None = None,
+) -> dict[Month, MonthlyTotals]:
+    """Calculate the totals for every month from start to end inclusive.
+
+    Gives the same results as chaining MonthlyTotals.from_transactions, starting from
+    prev_month if given, but packs all the transactions and assignments into a month x
+    category matrix of integer minor units and works through it with array operations.
+    """
+    months = list(Month.range(start, end))
+    keys = spec.all_category_keys
+    slots = spec.category_slots
+    n_months, n_categories = len(months), len(keys)
+
+    # pack transactions into columns of (month index, category index, units)
+    funding = np.zeros(n_months, dtype=np.int64)
+    spending_rows, spending_cols, spending_units = [], [], []
+    for row, month in enumerate(months):
+        for tx in monthly_transactions.get(month, []):
+            funding[row] += tx.funding_units
+            for key, units in tx.spending_units.items():
+                spending_rows.append(row)
+                spending_cols.append(slots[key])
+                spending_units.append(units)
+    spending = np.zeros((n_months, n_categories), dtype=np.int64)
+    np.add.at(
+        spending,
+        (
+            np.array(spending_rows, dtype=np.intp),
+            np.array(spending_cols, dtype=np.intp),
+        ),
+        np.array(spending_units, dtype=np.int64),
+    )
+
+    assigning = np.zeros((n_months, n_categories), dtype=np.int64)
+    holding = np.zeros(n_months, dtype=np.int64)
+    for row, month in enumerate(months):
+        if (amounts := assigned.get(month)) is None:
+            continue
+        holding[row] = spec.to_units(amounts.held)
+        for key, amount in amounts.categories.items():
+            if amount.number:
+                assigning[row, slots[key]] = spec.to_units(amount)
+
+    if prev_month is None:
+        carryover = np.zeros(n_categories, dtype=np.int64)
+        previous_tba = previous_holding = previous_overspending = 0
+    else:
+        prev_carryover = prev_month.carryover_balances_units
+        carryover = np.array([prev_carryover[key] for key in keys], dtype=np.int64)
+        previous_tba = prev_month.to_be_assigned_units
+        previous_holding = prev_month.holding_units
+        previous_overspending = prev_month.overspending_units
+
+    # balances only carry forward when positive, so this has to step through months,
+    # but each step works across all categories at once
+    previous_carryover = np.empty((n_months, n_categories), dtype=np.int64)
+    balances = np.empty((n_months, n_categories), dtype=np.int64)
+    for row in range(n_months):
+        previous_carryover[row] = carryover
+        balances[row] = carryover + spending[row] + assigning[row]
+        carryover = np.maximum(balances[row], 0)
+    overspending = np.minimum(balances, 0).sum(axis=1)
+
+    # tba(n) = tba(n-1) + holding(n-1) + overspending(n-1) + funding(n)
+    #          - assigning(n) - holding(n)
+    carried_holding = np.concatenate(([previous_holding], holding[:-1]))
+    carried_overspending = np.concatenate(([previous_overspending], overspending[:-1]))
+    tba = previous_tba + np.cumsum(
+        carried_holding
+        + carried_overspending
+        + funding
+        - assigning.sum(axis=1)
+        - holding
+    )
+    carried_tba = np.concatenate(([previous_tba], tba[:-1]))
+
+    def units_map(row: np.ndarray) -> dict[str, int]:
+        return dict(zip(keys, row.tolist()))
+
+    totals = dict()
+    for row, month in enumerate(months):
+        totals[month] = MonthlyTotals(
+            spec,
+            previous_tba=int(carried_tba[row]),
+            previous_holding=int(carried_holding[row]),
+            previous_overspending=int(carried_overspending[row]),
+            funding=int(funding[row]),
+            holding=int(holding[row]),
+            previous_carryover=units_map(previous_carryover[row]),
+            spending=units_map(spending[row]),
+            assigning=units_map(assigning[row]),
+        )
+    return totals
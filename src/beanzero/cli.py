@@ -0,0 +1,48 @@
+import argparse
+from pathlib import Path
+
+from beanzero.budget import Budget, BudgetSpec
+from beanzero.budget.store import migrate_store
+
+
+def migrate_command(args: argparse.Namespace):
+    spec = BudgetSpec.load_path(args.config_file)
+    migrate_store(spec, spec.storage, args.dest.resolve())
+    print(f"Migrated {spec.storage} to {args.dest}")
+    print("Update storage in the budget config to start using it")
+
+
+def compile_command(args: argparse.Namespace):
+    budget = Budget(args.config_file)
+    budget.write_snapshot(args.output.resolve() if args.output else None)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="beanzero")
+    commands = parser.add_subparsers(required=True)
+
+    migrate_parser = commands.add_parser(
+        "migrate",
+        help="copy the budget store to a new file, converting between JSON and SQLite",
+    )
+    migrate_parser.add_argument("config_file", type=Path)
+    migrate_parser.add_argument(
+        "dest", type=Path, help="the new store, as SQLite if it ends with .sqlite"
+    )
+    migrate_parser.set_defaults(func=migrate_command)
+
+    compile_parser = commands.add_parser(
+        "compile",
+        help="calculate every month and save the totals to a snapshot for fast loading",
+    )
+    compile_parser.add_argument("config_file", type=Path)
+    compile_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="where to write the snapshot, if not set in the config",
+    )
+    compile_parser.set_defaults(func=compile_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
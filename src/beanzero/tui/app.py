@@ -1,21 +1,36 @@
 import argparse
+import functools
 import gettext
+import threading
+import typing
 from pathlib import Path
 
 import beancount.core.amount as amt
 from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.reactive import reactive
+from textual.timer import Timer
 from textual.widgets import Footer, Header, Static
+from textual.worker import get_current_worker
 
 from beanzero.budget import Budget, BudgetSpec, Month
 from beanzero.budget.core import MonthlyTotals
 from beanzero.budget.spec import CategoryKey
 from beanzero.tui.category_table import CategoryTable
 from beanzero.tui.top_bar import TopBar
+from beanzero.tui.view import MONTH_VIEW_CACHE_SIZE, MonthView
 
 _ = gettext.gettext
 
+# how often to check the ledger's include tree for changes, in seconds
+LEDGER_POLL_INTERVAL = 2.0
+
+# how long to wait after the last edit before saving, in seconds
+SAVE_DELAY = 0.5
+
+# the months either side of the current one to prepare views for in the background
+PREFETCH_OFFSETS = (1, -1, 12, -12)
+
 
 class BeanZeroApp(App):
     TITLE = "Bean0"
@@ -38,7 +53,10 @@ class BeanZeroApp(App):
     spec: BudgetSpec
 
     current_month: reactive[Month] = reactive(Month.now())
+    # the month being navigated to, which current_month catches up with once a frame
+    target_month: reactive[Month] = reactive(Month.now())
     current_totals: reactive[MonthlyTotals | None] = reactive(None)
+    current_view: reactive[MonthView | None] = reactive(None)
 
     def __init__(self):
         super().__init__()
@@ -52,6 +70,118 @@ class BeanZeroApp(App):
         if self.spec.theme:
             self.theme = self.spec.theme
 
+        # edits waiting to be saved, keyed so later edits replace earlier ones
+        self._unsaved_edits: dict[tuple[Month, CategoryKey | None], amt.Amount] = {}
+        self._unsaved_lock = threading.Lock()
+        # held for the whole of each save, so edits are written in order
+        self._save_lock = threading.Lock()
+        self._save_timer: Timer | None = None
+        # set once the user has been warned that quitting will lose unsaved edits
+        self._quit_unsaved = False
+
+        # prepared views of recently visited and prefetched months
+        self._month_views: dict[Month, MonthView] = {}
+        self._month_views_lock = threading.Lock()
+
+        self._month_change_pending = False
+
+    def on_mount(self):
+        self.set_interval(LEDGER_POLL_INTERVAL, self.start_reload)
+
+    async def action_quit(self):
+        """Save any unsaved edits before quitting, and stay open if that fails.
+
+        Quitting again straight afterwards quits anyway, losing the unsaved edits.
+        """
+        if self._save_timer is not None:
+            self._save_timer.stop()
+            self._save_timer = None
+        if (error := self.save_edits()) is not None and not self._quit_unsaved:
+            self._quit_unsaved = True
+            self.notify(
+                _("{error}\nQuit again to lose your unsaved edits.").format(
+                    error=error
+                ),
+                title=_("Couldn't save budget"),
+                severity="error",
+            )
+            return
+        self.exit()
+
+    def on_unmount(self):
+        if self._save_timer is not None:
+            self._save_timer.stop()
+        if (error := self.save_edits()) is not None:
+            # leave the journal as it is, so the edits it holds are replayed next time
+            self.exit(
+                return_code=1,
+                message=_("Couldn't save budget: {error}").format(error=error),
+            )
+            return
+        # fold the journal of this session's edits back into the budget store
+        self.budget.compact_journal()
+
+    def queue_save(self, category: CategoryKey | None, amount: amt.Amount):
+        """Save an edit to the current month once edits have paused for a moment."""
+        with self._unsaved_lock:
+            self._unsaved_edits[(self.current_month, category)] = amount
+        self._quit_unsaved = False
+        if self._save_timer is not None:
+            self._save_timer.stop()
+        self._save_timer = self.set_timer(SAVE_DELAY, self.start_save)
+
+    def start_save(self):
+        self._save_timer = None
+        self.run_worker(self.save_edits_in_background, thread=True, group="save")
+
+    def save_edits_in_background(self):
+        if (error := self.save_edits()) is not None:
+            self.call_from_thread(
+                self.notify,
+                str(error),
+                title=_("Couldn't save budget"),
+                severity="error",
+            )
+
+    def save_edits(self) -> OSError | None:
+        """Write out every unsaved edit, returning the error if that fails.
+
+        Failed edits are kept to be tried again with the next save.
+        """
+        with self._save_lock:
+            with self._unsaved_lock:
+                edits, self._unsaved_edits = self._unsaved_edits, {}
+            if not edits:
+                return None
+
+            try:
+                self.budget.journal_amounts(
+                    [(month, key, amount) for (month, key), amount in edits.items()]
+                )
+            except OSError as error:
+                with self._unsaved_lock:
+                    for key, amount in edits.items():
+                        self._unsaved_edits.setdefault(key, amount)
+                return error
+            return None
+
+    def start_reload(self):
+        self.run_worker(
+            self.reload_ledger_in_background,
+            thread=True,
+            group="reload",
+            exclusive=True,
+        )
+
+    def reload_ledger_in_background(self):
+        if self.budget.reload_ledger() is not None:
+            self.call_from_thread(self.refresh_after_reload)
+
+    def refresh_after_reload(self):
+        # re-validate, in case the ledger's start month has moved
+        self.current_month = self.current_month
+        self.refresh_totals()
+
     def validate_current_month(self, new: Month):
         if new < self.budget.ledger_start_month:
             return self.budget.ledger_start_month
@@ -60,25 +190,111 @@ class BeanZeroApp(App):
         else:
             return new
 
+    def validate_target_month(self, new: Month):
+        return self.validate_current_month(new)
+
     def watch_current_month(self, new: Month):
-        self.current_totals = self.budget.monthly_totals[new]
+        self.current_totals = self.budget.totals_for(new)
+        # always refresh the calendar, as the range of months may have changed too
+        self.set_reactive(BeanZeroApp.target_month, new)
+        self.mutate_reactive(BeanZeroApp.target_month)
+
+    def navigate_to(self, month: Month):
+        """Move to a month, coalescing every move made within a frame into one.
+
+        The target month is shown straight away, but the current month, and so
+        everything that depends on it, is only updated after the next refresh.
+        """
+        self.target_month = month
+        if not self._month_change_pending:
+            self._month_change_pending = True
+            self.call_after_refresh(self.apply_target_month)
+
+    def apply_target_month(self):
+        self._month_change_pending = False
+        self.current_month = self.target_month
+
+    def watch_current_totals(self, new: MonthlyTotals | None):
+        if new is None:
+            self.current_view = None
+            return
+        self.current_view = self.month_view(self.current_month, new)
+        self.run_worker(
+            self.prefetch_month_views,
+            thread=True,
+            group="prefetch",
+            exclusive=True,
+        )
+
+    def month_view(self, month: Month, totals: MonthlyTotals) -> MonthView:
+        """The view of a month's totals, reusing a prepared one if it's up to date."""
+        view = self._month_views.get(month)
+        if view is None or view.totals is not totals:
+            view = MonthView.from_totals(self.spec, month, totals)
+            with self._month_views_lock:
+                self._month_views[month] = view
+                while len(self._month_views) > MONTH_VIEW_CACHE_SIZE:
+                    del self._month_views[next(iter(self._month_views))]
+        return view
+
+    def prefetch_month_views(self):
+        """Prepare views of the months around the current one, so they show at once."""
+        month = self.current_month
+        worker = get_current_worker()
+        for offset in PREFETCH_OFFSETS:
+            if worker.is_cancelled:
+                return
+            if (totals := self.budget.totals_for(month + offset)) is not None:
+                self.month_view(month + offset, totals)
 
     def action_change_month(self, delta: int):
-        self.current_month += delta
+        self.navigate_to(self.target_month + delta)
 
     def action_set_month(self, new: int):
-        self.current_month = Month(new, self.current_month.year)
+        self.navigate_to(Month(new, self.target_month.year))
 
     def action_set_assigned(self, key: CategoryKey, new_amount: amt.Amount):
-        self.budget.update_assigned_amount(self.current_month, key, new_amount)
-        self.current_totals = self.budget.monthly_totals[self.current_month]
-        # just make sure we refresh everything
-        self.mutate_reactive(BeanZeroApp.current_totals)
-        self.mutate_reactive(BeanZeroApp.current_month)
+        self.budget.set_assigned_amount(self.current_month, key, new_amount)
+        self.queue_save(key, new_amount)
+        self.recalculate(self.budget.recalculate(self.current_month, key))
 
     def action_set_held(self, new_amount: amt.Amount):
-        self.budget.update_held_amount(self.current_month, new_amount)
-        self.current_totals = self.budget.monthly_totals[self.current_month]
+        self.budget.set_held_amount(self.current_month, new_amount)
+        self.queue_save(None, new_amount)
+        self.recalculate(self.budget.recalculate(self.current_month))
+
+    def recalculate(self, months: typing.Iterator[Month]):
+        """Bring the totals up to date after an edit to the current month.
+
+        Months are recalculated straight away up to the current month, so the edit
+        shows at once, and the rest of the months in a worker, cancelling any
+        recalculation that's still running from an earlier edit. Recalculation may
+        start before the current month, to catch up with months left stale by that.
+        """
+        for month in months:
+            if month >= self.current_month:
+                break
+        self.refresh_totals()
+        self.run_worker(
+            functools.partial(self.recalculate_in_background, months),
+            thread=True,
+            group="recalculate",
+            exclusive=True,
+        )
+
+    def recalculate_in_background(self, months: typing.Iterator[Month]):
+        worker = get_current_worker()
+        for month in months:
+            if worker.is_cancelled:
+                # the months we didn't get to are picked up by the next recalculation
+                return
+            if month == self.current_month:
+                self.call_from_thread(self.refresh_totals)
+        if not worker.is_cancelled:
+            self.call_from_thread(self.refresh_totals)
+
+    def refresh_totals(self):
+        self.current_totals = self.budget.totals_for(self.current_month)
         # just make sure we refresh everything
         self.mutate_reactive(BeanZeroApp.current_totals)
         self.mutate_reactive(BeanZeroApp.current_month)
@@ -91,7 +307,7 @@ class BeanZeroApp(App):
         yield Footer()
 
     def action_focus_next_group(self):
-        return self.screen.focus_next("CategoryGroup")
+        return self.screen.focus_next("CategoryGroup, CategoryLines")
 
     def action_focus_previous_group(self):
-        return self.screen.focus_previous("CategoryGroup")
+        return self.screen.focus_previous("CategoryGroup, CategoryLines")
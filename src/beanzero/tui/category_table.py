@@ -2,18 +2,25 @@ import gettext
 from decimal import Decimal, InvalidOperation
 
 import beancount.core.amount as amt
+from rich.segment import Segment
+from rich.style import Style
 from rich.text import Text
+from textual import events
 from textual.app import ComposeResult, RenderResult
 from textual.binding import Binding
 from textual.containers import Horizontal, Vertical
 from textual.content import Content
-from textual.reactive import reactive
+from textual.geometry import Region, Size
+from textual.message import Message
+from textual.reactive import reactive, var
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
 from textual.widget import Widget
 from textual.widgets import DataTable, Digits, Input, Static
 
 import beanzero.budget.spec as spec
-from beanzero.budget.core import MonthlyTotals
 from beanzero.tui.interface import BeanZeroAppInterface
+from beanzero.tui.view import AmountView, MonthView
 
 _ = gettext.gettext
 
@@ -21,24 +28,60 @@ PL_PILL_LEFT = "\ue0b6"
 PL_PILL_RIGHT = "\ue0b4"
 
 
+def parse_assignment(
+    app: BeanZeroAppInterface, new_input: str, current: amt.Amount
+) -> amt.Amount | None:
+    """Parse an edited amount, which is relative to current if it starts with + or -.
+
+    Notifies the user and returns None if the input isn't a valid amount.
+    """
+    try:
+        if new_input.startswith("+") or new_input.startswith("-"):
+            new_value = current.number + Decimal(new_input)
+        elif new_input.startswith("="):
+            new_value = Decimal(new_input[1:])
+        else:
+            new_value = Decimal(new_input)
+    except InvalidOperation:
+        app.notify(
+            f"Couldn't parse '{new_input}'",
+            title="Assignment unchanged",
+            severity="warning",
+        )
+        return None
+
+    new_assigned = amt.Amount(new_value, app.spec.currency)
+    if not app.spec.is_amount_suitable_precision(new_assigned):
+        app.notify(
+            f"Amount {new_assigned} is too high precision for this budget",
+            title="Assignment unchanged",
+            severity="warning",
+        )
+        return None
+    return new_assigned
+
+
 class AvailableBubble(Widget):
     can_focus = False
 
-    amount: amt.Amount
+    view: reactive[AmountView | None] = reactive(None)
 
-    def __init__(self, amount: amt.Amount, **kwargs):
-        self.amount = amount
+    def __init__(self, view: AmountView, **kwargs):
         super().__init__(**kwargs)
+        self.set_reactive(AvailableBubble.view, view)
 
     def render(self) -> RenderResult:
+        if self.view is None:
+            return ""
+
         text = "$text"
         fg = None
         sym = None
 
-        if self.amount == self.app.spec.zero:
+        if self.view.zero:
             bg = "$background-lighten-2"
             text = "$foreground-muted"
-        elif self.amount < self.app.spec.zero:
+        elif self.view.negative:
             bg = "$error"
             fg = "$text"
             sym = "!"
@@ -53,34 +96,30 @@ class AvailableBubble(Widget):
             + f"[{bg}]{PL_PILL_RIGHT}[/]"
         )
 
-        return Content.from_markup(
-            bubble_markup, amount=self.app.spec.format_currency(self.amount)
-        )
+        return Content.from_markup(bubble_markup, amount=self.view.text)
 
 
 class Amount(Widget):
     app: BeanZeroAppInterface
 
-    amount: amt.Amount
+    view: reactive[AmountView | None] = reactive(None)
 
-    def __init__(self, amount: amt.Amount, **kwargs):
-        self.amount = amount
+    def __init__(self, view: AmountView, **kwargs):
         super().__init__(**kwargs)
+        self.set_reactive(Amount.view, view)
+        self.set_class(view.zero, "zero")
 
-    def render(self) -> RenderResult:
-        if self.amount == self.app.spec.zero:
-            self.add_class("zero")
-        else:
-            self.remove_class("zero")
+    def watch_view(self, view: AmountView | None):
+        self.set_class(view is None or view.zero, "zero")
 
-        if self.amount is not None:
-            return self.app.spec.format_currency(self.amount)
-        else:
-            return ""
+    def render(self) -> RenderResult:
+        return "" if self.view is None else self.view.text
 
 
 class HeldRow(Widget):
-    assigned: reactive[amt.Amount | None] = reactive(None, recompose=True)
+    # values are pushed into the existing child widgets as they change, rather than
+    # recomposing the row
+    assigned: var[AmountView | None] = var(None, init=False)
     editing_assigned: reactive[bool] = reactive(False, init=False)
 
     BINDINGS = [
@@ -121,24 +160,26 @@ class HeldRow(Widget):
         input = Input(classes="category-table--held-assigned", select_on_focus=False)
         input.styles.display = "none"
         yield input
-        static = Static(
-            self.app.spec.format_currency(self.assigned or self.app.spec.zero),
-            classes="category-table--held-assigned",
-        )
-        if self.assigned is None or self.assigned == self.app.spec.zero:
-            static.add_class("zero")
+        assigned = self.assigned or AmountView.from_units(self.app.spec, 0)
+        static = Static(assigned.text, classes="category-table--held-assigned")
+        static.set_class(assigned.zero, "zero")
         yield static
 
     def on_mount(self):
-        self.watch(self.app, "current_totals", self.app_watch_current_totals)
+        self.watch(self.app, "current_view", self.app_watch_current_view)
 
-    def app_watch_current_totals(self, new: MonthlyTotals | None):
+    def app_watch_current_view(self, new: MonthView | None):
         if new is None:
             return
         else:
-            self.assigned = new.holding
+            self.assigned = new.held
+
+    def watch_assigned(self, assigned: AmountView):
+        static = self.query_one("Static.category-table--held-assigned", Static)
+        static.update(assigned.text)
+        static.set_class(assigned.zero, "zero")
 
-    async def watch_editing_assigned(self, on):
+    def watch_editing_assigned(self, on):
         #  if we're enabling editing, then focus the input box
         if on:
             self.query_one(
@@ -160,35 +201,14 @@ class HeldRow(Widget):
             ).styles.display = "block"
 
             new_input = self.query_one(Input).value
-            if new_input != "":
-                try:
-                    if new_input.startswith("+") or new_input.startswith("-"):
-                        new_value = self.app.current_totals.holding.number + Decimal(
-                            new_input
-                        )
-                    elif new_input.startswith("="):
-                        new_value = Decimal(new_input[1:])
-                    else:
-                        new_value = Decimal(new_input)
-                    new_assigned = amt.Amount(new_value, self.app.spec.currency)
-
-                    if not self.app.spec.is_amount_suitable_precision(new_assigned):
-                        self.app.notify(
-                            f"Amount {new_assigned} is too high precision for this budget",
-                            title="Assignment unchanged",
-                            severity="warning",
-                        )
-                    else:
-                        self.app.action_set_held(new_assigned)
-
-                except InvalidOperation:
-                    self.app.notify(
-                        f"Couldn't parse '{new_input}'",
-                        title="Assignment unchanged",
-                        severity="warning",
-                    )
-
-            await self.recompose()
+            if new_input != "" and (
+                new_assigned := parse_assignment(
+                    self.app, new_input, self.app.current_totals.holding
+                )
+            ):
+                self.app.action_set_held(new_assigned)
+
+            self.query_one(Input).value = ""
             self.focus()
             self.remove_class("editing")
 
@@ -206,10 +226,12 @@ class HeldRow(Widget):
 
 class CategoryRow(Widget):
     app: BeanZeroAppInterface
-    name: reactive[str] = reactive("", recompose=True)
-    assigned: reactive[amt.Amount | None] = reactive(None, recompose=True)
-    spending: reactive[amt.Amount | None] = reactive(None, recompose=True)
-    balance: reactive[amt.Amount | None] = reactive(None, recompose=True)
+    # values are pushed into the existing child widgets as they change, rather than
+    # recomposing the row
+    name: var[str] = var("", init=False)
+    assigned: var[AmountView | None] = var(None, init=False)
+    spending: var[AmountView | None] = var(None, init=False)
+    balance: var[AmountView | None] = var(None, init=False)
 
     editing_assigned: reactive[bool] = reactive(False, init=False)
 
@@ -250,19 +272,26 @@ class CategoryRow(Widget):
         input = Input(classes="category-table--col-assigned", select_on_focus=False)
         input.styles.display = "none"
         yield input
-        yield Amount(
-            (self.assigned or self.app.spec.zero),
-            classes="category-table--col-assigned",
-        )
-        yield Amount(
-            (self.spending or self.app.spec.zero),
-            classes="category-table--col-spending",
-        )
+        zero = AmountView.from_units(self.app.spec, 0)
+        yield Amount(self.assigned or zero, classes="category-table--col-assigned")
+        yield Amount(self.spending or zero, classes="category-table--col-spending")
         yield AvailableBubble(
-            (self.balance or self.app.spec.zero), classes="category-table--col-balance"
+            self.balance or zero, classes="category-table--col-balance"
         )
 
-    async def watch_editing_assigned(self, on):
+    def watch_name(self, name: str):
+        self.query_one(".category-table--col-name", Static).update(name)
+
+    def watch_assigned(self, assigned: AmountView):
+        self.query_one("Amount.category-table--col-assigned", Amount).view = assigned
+
+    def watch_spending(self, spending: AmountView):
+        self.query_one("Amount.category-table--col-spending", Amount).view = spending
+
+    def watch_balance(self, balance: AmountView):
+        self.query_one(AvailableBubble).view = balance
+
+    def watch_editing_assigned(self, on):
         #  if we're enabling editing, then focus the input box
         if on:
             self.query_one(
@@ -282,35 +311,16 @@ class CategoryRow(Widget):
             ).styles.display = "block"
 
             new_input = self.query_one(Input).value
-            if new_input != "":
-                try:
-                    if new_input.startswith("+") or new_input.startswith("-"):
-                        new_value = self.app.current_totals.assigning[
-                            self.category_key
-                        ].number + Decimal(new_input)
-                    elif new_input.startswith("="):
-                        new_value = Decimal(new_input[1:])
-                    else:
-                        new_value = Decimal(new_input)
-                    new_assigned = amt.Amount(new_value, self.app.spec.currency)
-
-                    if not self.app.spec.is_amount_suitable_precision(new_assigned):
-                        self.app.notify(
-                            f"Amount {new_assigned} is too high precision for this budget",
-                            title="Assignment unchanged",
-                            severity="warning",
-                        )
-                    else:
-                        self.app.action_set_assigned(self.category_key, new_assigned)
-
-                except InvalidOperation:
-                    self.app.notify(
-                        f"Couldn't parse '{new_input}'",
-                        title="Assignment unchanged",
-                        severity="warning",
-                    )
-
-            await self.recompose()
+            if new_input != "" and (
+                new_assigned := parse_assignment(
+                    self.app,
+                    new_input,
+                    self.app.current_totals.assigning[self.category_key],
+                )
+            ):
+                self.app.action_set_assigned(self.category_key, new_assigned)
+
+            self.query_one(Input).value = ""
             self.focus()
             self.remove_class("editing")
 
@@ -328,31 +338,38 @@ class CategoryRow(Widget):
 
 class CategoryGroupHeader(Widget):
     app: BeanZeroAppInterface
-    name: reactive[str] = reactive("", recompose=True)
-    assigned: reactive[amt.Amount | None] = reactive(None, recompose=True)
-    spending: reactive[amt.Amount | None] = reactive(None, recompose=True)
-    balance: reactive[amt.Amount | None] = reactive(None, recompose=True)
+    name: var[str] = var("", init=False)
+    assigned: var[AmountView | None] = var(None, init=False)
+    spending: var[AmountView | None] = var(None, init=False)
+    balance: var[AmountView | None] = var(None, init=False)
 
     def compose(self) -> ComposeResult:
         yield Static(self.name, classes="category-table--col-name")
-        yield Amount(
-            (self.assigned or self.app.spec.zero),
-            classes="category-table--col-assigned",
-        )
-        yield Amount(
-            (self.spending or self.app.spec.zero),
-            classes="category-table--col-spending",
-        )
-        yield Amount(
-            (self.balance or self.app.spec.zero), classes="category-table--col-balance"
-        )
+        zero = AmountView.from_units(self.app.spec, 0)
+        yield Amount(self.assigned or zero, classes="category-table--col-assigned")
+        yield Amount(self.spending or zero, classes="category-table--col-spending")
+        yield Amount(self.balance or zero, classes="category-table--col-balance")
+
+    def watch_name(self, name: str):
+        self.query_one(".category-table--col-name", Static).update(name)
+
+    def watch_assigned(self, assigned: AmountView):
+        self.query_one("Amount.category-table--col-assigned", Amount).view = assigned
+
+    def watch_spending(self, spending: AmountView):
+        self.query_one("Amount.category-table--col-spending", Amount).view = spending
+
+    def watch_balance(self, balance: AmountView):
+        self.query_one("Amount.category-table--col-balance", Amount).view = balance
 
 
 class CategoryGroup(Widget):
     group: spec.CategoryGroup
 
-    def __init__(self, group: spec.CategoryGroup, **kwargs):
+    def __init__(self, group: spec.CategoryGroup, index: int, **kwargs):
         self.group = group
+        # the group's position in the spec, and in each month's view
+        self.index = index
         self.can_focus = True
         super().__init__(**kwargs)
 
@@ -362,23 +379,246 @@ class CategoryGroup(Widget):
             yield CategoryRow(category.key)
 
     def on_mount(self):
-        self.watch(self.app, "current_totals", self.app_watch_current_totals)
+        self.watch(self.app, "current_view", self.app_watch_current_view)
         self.query_one(CategoryGroupHeader).name = self.group.name
         for category, widget in zip(self.group.categories, self.query(CategoryRow)):
             widget.name = category.name
 
-    def app_watch_current_totals(self, new: MonthlyTotals | None):
+    def app_watch_current_view(self, new: MonthView | None):
         if new is None:
             return
 
-        self.query_one(CategoryGroupHeader).assigned = new.group_assigned(self.group)
-        self.query_one(CategoryGroupHeader).spending = new.group_spending(self.group)
-        self.query_one(CategoryGroupHeader).balance = new.group_balance(self.group)
+        header = self.query_one(CategoryGroupHeader)
+        group_view = new.groups[self.index]
+        header.assigned = group_view.assigned
+        header.spending = group_view.spending
+        header.balance = group_view.balance
 
         for category, widget in zip(self.group.categories, self.query(CategoryRow)):
-            widget.assigned = new.assigning[category.key]
-            widget.spending = new.spending[category.key]
-            widget.balance = new.category_balances[category.key]
+            row_view = new.categories[category.key]
+            widget.assigned = row_view.assigned
+            widget.spending = row_view.spending
+            widget.balance = row_view.balance
+
+
+# column widths for the virtual category table, matching the widget table's CSS
+NAME_WIDTH = 40
+AMOUNT_WIDTH = 16
+BALANCE_WIDTH = 18
+ROW_WIDTH = NAME_WIDTH + 2 * AMOUNT_WIDTH + BALANCE_WIDTH
+
+
+class CategoryLines(ScrollView, can_focus=True):
+    """Draws every group and category as a single line, with a cursor.
+
+    Only the lines scrolled into view are rendered, straight from the current month's
+    view, so the cost of changing months doesn't grow with the number of categories.
+    """
+
+    app: BeanZeroAppInterface
+
+    COMPONENT_CLASSES = {
+        "category-lines--group",
+        "category-lines--row",
+        "category-lines--row-odd",
+        "category-lines--cursor",
+        "category-lines--zero",
+        "category-lines--positive",
+        "category-lines--negative",
+    }
+
+    BINDINGS = [
+        Binding("j,down", "move_cursor(1)", "↓", show=False),
+        Binding("k,up", "move_cursor(-1)", "↑", show=False),
+        Binding("J", "move_to_group(1)", "↡", show=False),
+        Binding("K", "move_to_group(-1)", "↟", show=False),
+        Binding(
+            "enter",
+            "edit_assigned()",
+            _("Assign"),
+            tooltip=_("Edit amount assigned to category."),
+        ),
+        Binding(
+            "=",
+            "edit_assigned('=')",
+            _("Set assigned"),
+            tooltip=_("Set amount assigned to category."),
+        ),
+        Binding(
+            "+",
+            "edit_assigned('+')",
+            _("Assign more"),
+            tooltip=_("Increase amount assigned to category."),
+        ),
+        Binding(
+            "-",
+            "edit_assigned('-')",
+            _("Assign less"),
+            tooltip=_("Decrease amount assigned to category."),
+        ),
+    ]
+
+    cursor: reactive[int] = reactive(0)
+
+    class EditAssigned(Message):
+        def __init__(self, category: spec.Category, prepend: str | None):
+            self.category = category
+            self.prepend = prepend
+            super().__init__()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # each line is a group's index and the group, and a group header line has no
+        # category
+        self.lines: list[tuple[int, spec.CategoryGroup, spec.Category | None]] = []
+        for i, group in enumerate(self.app.spec.groups):
+            self.lines.append((i, group, None))
+            self.lines.extend((i, group, category) for category in group.categories)
+        self.virtual_size = Size(ROW_WIDTH, len(self.lines))
+
+    def on_mount(self):
+        self.watch(self.app, "current_view", self.app_watch_current_view)
+
+    def app_watch_current_view(self, new: MonthView | None):
+        self.refresh()
+
+    def validate_cursor(self, cursor: int) -> int:
+        return max(0, min(cursor, len(self.lines) - 1))
+
+    def watch_cursor(self, old: int, new: int):
+        self.refresh_line(old)
+        self.refresh_line(new)
+        self.scroll_to_region(Region(0, new, ROW_WIDTH, 1), animate=False)
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        index = y + scroll_y
+        width = self.size.width
+        view = self.app.current_view
+        if view is None or index >= len(self.lines):
+            return Strip.blank(width, self.rich_style)
+
+        group_index, group, category = self.lines[index]
+        if index == self.cursor and self.has_focus:
+            row_style = self.get_component_rich_style("category-lines--cursor")
+        elif category is None:
+            row_style = self.get_component_rich_style("category-lines--group")
+        elif index % 2:
+            row_style = self.get_component_rich_style("category-lines--row-odd")
+        else:
+            row_style = self.get_component_rich_style("category-lines--row")
+
+        if category is None:
+            name = group.name
+            row_view = view.groups[group_index]
+        else:
+            name = category.name
+            row_view = view.categories[category.key]
+
+        margin = max(0, (width - ROW_WIDTH) // 2)
+        segments = [
+            Segment(" " * margin, row_style),
+            Segment(name[:NAME_WIDTH].ljust(NAME_WIDTH), row_style),
+            self.amount_segment(row_view.assigned, AMOUNT_WIDTH, row_style),
+            self.amount_segment(row_view.spending, AMOUNT_WIDTH, row_style),
+            self.amount_segment(
+                row_view.balance, BALANCE_WIDTH - 1, row_style, signed=True
+            ),
+            Segment(" " * (width - margin - ROW_WIDTH + 1), row_style),
+        ]
+        return Strip(segments).crop(scroll_x, scroll_x + width)
+
+    def amount_segment(
+        self, amount: AmountView, width: int, row_style: Style, signed: bool = False
+    ) -> Segment:
+        text = amount.text
+        if amount.zero:
+            style = self.get_component_rich_style("category-lines--zero")
+        elif signed and amount.negative:
+            style = self.get_component_rich_style("category-lines--negative")
+            text = f"! {text}"
+        elif signed:
+            style = self.get_component_rich_style("category-lines--positive")
+        else:
+            style = Style()
+        return Segment(text.rjust(width), row_style + style)
+
+    def on_click(self, event: events.Click):
+        self.cursor = event.y + self.scroll_offset.y
+
+    def on_focus(self):
+        self.refresh_line(self.cursor)
+
+    def on_blur(self):
+        self.refresh_line(self.cursor)
+
+    def action_move_cursor(self, delta: int):
+        cursor = self.cursor + delta
+        # moving off either end of the table moves focus out of it, like the rows
+        # of the widget table
+        if cursor < 0:
+            self.screen.focus_previous()
+        elif cursor >= len(self.lines):
+            self.screen.focus_next()
+        else:
+            self.cursor = cursor
+
+    def action_move_to_group(self, delta: int):
+        cursor = self.cursor + delta
+        while 0 <= cursor < len(self.lines) and self.lines[cursor][2] is not None:
+            cursor += delta
+        if 0 <= cursor < len(self.lines):
+            self.cursor = cursor
+
+    def action_edit_assigned(self, prepend: str | None = None):
+        _, _, category = self.lines[self.cursor]
+        if category is not None:
+            self.post_message(self.EditAssigned(category, prepend))
+
+
+class VirtualCategories(Widget):
+    """The virtual category table, with an input for editing assigned amounts."""
+
+    app: BeanZeroAppInterface
+
+    editing: spec.Category | None = None
+
+    def compose(self) -> ComposeResult:
+        yield CategoryLines()
+        input = Input(id="category-lines-input", select_on_focus=False)
+        input.styles.display = "none"
+        yield input
+
+    def on_category_lines_edit_assigned(self, event: CategoryLines.EditAssigned):
+        self.editing = event.category
+        input = self.query_one(Input)
+        input.value = event.prepend or ""
+        input.placeholder = _("Assign to {name}").format(name=event.category.name)
+        input.styles.display = "block"
+        input.focus()
+
+    def finish_editing(self):
+        if (category := self.editing) is None:
+            return
+        self.editing = None
+
+        input = self.query_one(Input)
+        new_input, input.value = input.value, ""
+        input.styles.display = "none"
+        if new_input != "" and (
+            new_assigned := parse_assignment(
+                self.app, new_input, self.app.current_totals.assigning[category.key]
+            )
+        ):
+            self.app.action_set_assigned(category.key, new_assigned)
+        self.query_one(CategoryLines).focus()
+
+    def on_descendant_blur(self, event):
+        if isinstance(event.widget, Input):
+            self.finish_editing()
+
+    def on_input_submitted(self, event):
+        self.finish_editing()
 
 
 class CategoryTable(Widget):
@@ -391,6 +631,9 @@ class CategoryTable(Widget):
             yield Static(_("Assigned"), classes="category-table--col-assigned")
             yield Static(_("Spent"), classes="category-table--col-spending")
             yield Static(_("Balance"), classes="category-table--col-balance")
-        with Vertical(id="categories"):
-            for group in self.app.spec.groups:
-                yield CategoryGroup(group)
+        if self.app.spec.table_layout == "virtual":
+            yield VirtualCategories(id="categories")
+        else:
+            with Vertical(id="categories"):
+                for i, group in enumerate(self.app.spec.groups):
+                    yield CategoryGroup(group, i)
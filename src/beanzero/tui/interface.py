@@ -2,6 +2,7 @@ from textual.app import App
 
 from beanzero.budget import Budget, BudgetSpec, Month
 from beanzero.budget.core import MonthlyTotals
+from beanzero.tui.view import MonthView
 
 
 # for better type hinting of self.app without circular imports
@@ -9,4 +10,6 @@ class BeanZeroAppInterface(App):
     budget: Budget
     spec: BudgetSpec
     current_month: Month
+    target_month: Month
     current_totals: MonthlyTotals | None
+    current_view: MonthView | None
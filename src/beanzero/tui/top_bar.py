@@ -1,7 +1,6 @@
 import gettext
 import typing
 
-import beancount.core.amount as amt
 from textual.app import App, ComposeResult, RenderResult
 from textual.containers import Horizontal, Vertical
 from textual.reactive import reactive
@@ -9,8 +8,8 @@ from textual.widget import Widget
 from textual.widgets import Digits, Static
 
 from beanzero.budget import Month
-from beanzero.budget.core import MonthlyTotals
 from beanzero.tui.interface import BeanZeroAppInterface
+from beanzero.tui.view import MonthView
 
 _ = gettext.gettext
 
@@ -34,9 +33,9 @@ class Calendar(Widget):
             self.app.action_set_month(self.month)  # type: ignore
 
     def on_mount(self):
-        self.watch(self.app, "current_month", self.app_watch_current_month)
+        self.watch(self.app, "target_month", self.app_watch_target_month)
 
-    def app_watch_current_month(self, new):
+    def app_watch_target_month(self, new):
         self.query_one("#year", Static).update(str(new.year))
         months = self.query(self.CalendarMonth)
         for i, month in enumerate(months):
@@ -67,23 +66,14 @@ class TbaSummary(Widget):
     app: BeanZeroAppInterface
 
     def on_mount(self):
-        self.watch(self.app, "current_totals", self.app_watch_current_totals)
+        self.watch(self.app, "current_view", self.app_watch_current_view)
 
-    def app_watch_current_totals(self, new: MonthlyTotals | None):
+    def app_watch_current_view(self, new: MonthView | None):
         if new is None:
             return
-        new_previous = amt.add(
-            amt.add(new.previous_tba, new.previous_holding), new.previous_overspending
-        )
-        self.query_one("#previous", Static).update(
-            self.app.spec.format_currency(new_previous)
-        )
-        self.query_one("#funded", Static).update(
-            self.app.spec.format_currency(new.funding)
-        )
-        self.query_one("#assigned", Static).update(
-            self.app.spec.format_currency(-new.total_assigning)
-        )
+        self.query_one("#previous", Static).update(new.previous.text)
+        self.query_one("#funded", Static).update(new.funded.text)
+        self.query_one("#assigned", Static).update(new.assigned.text)
 
     def compose(self) -> ComposeResult:
         yield Static(_("From previous"), classes="key")
@@ -98,20 +88,13 @@ class ToBeAssigned(Widget):
     app: BeanZeroAppInterface
 
     def on_mount(self):
-        self.watch(self.app, "current_totals", self.app_watch_current_totals)
+        self.watch(self.app, "current_view", self.app_watch_current_view)
 
-    def app_watch_current_totals(self, new: MonthlyTotals | None):
+    def app_watch_current_view(self, new: MonthView | None):
         if new is None:
             return
-        tba = new.to_be_assigned
-        if tba < self.app.spec.zero:
-            self.add_class("negative")
-        else:
-            self.remove_class("negative")
-        digits = self.query_one("#tba-digits", Digits)
-        digits.update(
-            self.app.spec.format_currency(new.to_be_assigned, symbol_override=False)
-        )
+        self.set_class(new.to_be_assigned.negative, "negative")
+        self.query_one("#tba-digits", Digits).update(new.to_be_assigned.text)
 
     def compose(self) -> ComposeResult:
         yield Static(_("TBA"), id="tba-left-label")
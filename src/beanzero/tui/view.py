@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import beancount.core.amount as amt
+from attrs import define
+
+from beanzero.budget.core import MonthlyTotals
+from beanzero.budget.spec import BudgetSpec, CategoryKey, Month
+
+# how many months of prepared views the app holds on to
+MONTH_VIEW_CACHE_SIZE = 48
+
+
+@define(frozen=True)
+class AmountView:
+    """An amount, formatted and classified ready for display."""
+
+    amount: amt.Amount
+    text: str
+    zero: bool
+    negative: bool
+
+    @classmethod
+    def from_units(
+        cls, spec: BudgetSpec, units: int, symbol_override: bool | None = None
+    ) -> AmountView:
+        amount = spec.from_units(units)
+        return cls(
+            amount, spec.format_currency(amount, symbol_override), units == 0, units < 0
+        )
+
+
+@define(frozen=True)
+class RowView:
+    """The assigned, spent and balance columns for a category or group."""
+
+    assigned: AmountView
+    spending: AmountView
+    balance: AmountView
+
+
+@define(frozen=True)
+class MonthView:
+    """Everything the app displays for a month, formatted and rolled up in advance.
+
+    Built from a month's totals, and only valid for as long as those are the budget's
+    current totals for the month.
+    """
+
+    month: Month
+    totals: MonthlyTotals
+    previous: AmountView
+    funded: AmountView
+    assigned: AmountView
+    to_be_assigned: AmountView
+    held: AmountView
+    # in the same order as the spec's groups
+    groups: list[RowView]
+    categories: dict[CategoryKey, RowView]
+
+    @classmethod
+    def from_totals(
+        cls, spec: BudgetSpec, month: Month, totals: MonthlyTotals
+    ) -> MonthView:
+        def amount(units: int, symbol_override: bool | None = None) -> AmountView:
+            return AmountView.from_units(spec, units, symbol_override)
+
+        assigning = totals.assigning_units
+        spending = totals.spending_units
+        balances = totals.category_balances_units
+        categories = {
+            key: RowView(
+                amount(assigning[key]), amount(spending[key]), amount(balances[key])
+            )
+            for key in spec.all_category_keys
+        }
+        groups = [
+            RowView(
+                amount(sum(assigning[c.key] for c in group.categories)),
+                amount(sum(spending[c.key] for c in group.categories)),
+                amount(sum(balances[c.key] for c in group.categories)),
+            )
+            for group in spec.groups
+        ]
+        return cls(
+            month,
+            totals,
+            amount(
+                totals.previous_tba_units
+                + totals.previous_holding_units
+                + totals.previous_overspending_units
+            ),
+            amount(totals.funding_units),
+            amount(-totals.total_assigning_units),
+            amount(totals.to_be_assigned_units, symbol_override=False),
+            amount(totals.holding_units),
+            groups,
+            categories,
+        )
@@ -1,7 +1,9 @@
 import os
+import shutil
 from pathlib import Path
 
 import beancount as b
+import beancount.loader
 import pytest
 
 from beanzero.budget.budget import Budget
@@ -22,6 +24,49 @@ def data_dir():
     return path.resolve()
 
 
+@pytest.fixture
+def tmp_budget_path(data_dir, tmp_path):
+    """A copy of the sample budget that tests are free to modify."""
+    for name in ["sample-budget.bean", "sample-budget.json", "sample-budget.yml"]:
+        shutil.copy(data_dir / name, tmp_path / name)
+    return tmp_path / "sample-budget.yml"
+
+
+def import_tx(amount_str):
+    return (
+        '\n2025-02-03 * "Cafe"\n'
+        f"    Expenses:Eating-Out                    {amount_str} AUD\n"
+        "    Liabilities:Credit-Card\n"
+    )
+
+
+@pytest.fixture
+def glob_budget_path(tmp_budget_path):
+    """The sample budget, with its ledger also including a glob of imported files."""
+    root = tmp_budget_path.parent / "main.bean"
+    root.write_text('include "sample-budget.bean"\ninclude "imports/*.bean"\n')
+    imports = tmp_budget_path.parent / "imports"
+    imports.mkdir()
+    (imports / "a.bean").write_text(import_tx("10.00"))
+    spec_text = tmp_budget_path.read_text()
+    tmp_budget_path.write_text(spec_text.replace("./sample-budget.bean", "./main.bean"))
+    return tmp_budget_path
+
+
+@pytest.fixture
+def loader_calls(monkeypatch):
+    """Records the paths of every ledger loaded with the beancount loader."""
+    calls = []
+    load_file = beancount.loader.load_file
+
+    def spy(filename, *args, **kwargs):
+        calls.append(filename)
+        return load_file(filename, *args, **kwargs)
+
+    monkeypatch.setattr(beancount.loader, "load_file", spy)
+    return calls
+
+
 @pytest.fixture
 def spec(request, data_dir):
     filename = request.node.get_closest_marker("spec_file").args[0]
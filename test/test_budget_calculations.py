@@ -52,6 +52,20 @@ class TestTransactionConversion:
             "rent": AUD("-120.00"),
             "utilities": AUD("-80.00"),
         }
+        assert btx.spending_units == {"rent": -12000, "utilities": -8000}
+
+    def test_sub_cent_postings_rounded(self, spec, tx):
+        bd.create_simple_posting(tx, "Expenses:Car:Petrol", b.D("45.673"), "AUD")
+        bd.create_simple_posting(tx, "Expenses:Car:Petrol", b.D("20.005"), "AUD")
+        bd.create_simple_posting(tx, "Assets:Checking", b.D("-65.678"), "AUD")
+        btx = BudgetTransaction.from_beancount_tx(spec, tx)
+        # only rounded once each sum is complete
+        assert btx.flow == AUD("-65.68")
+        assert btx.spending_units == {"car": -6568}
+        assert btx.funding == ZERO
+        # assigned amounts are still held to the currency's precision
+        with pytest.raises(ValueError, match="exceeds AUD precision"):
+            spec.to_units(AUD("45.678"))
 
     def test_simple_expense_refund(self, spec, tx):
         bd.create_simple_posting(tx, "Expenses:Rent", b.D("-200.00"), "AUD")
@@ -239,3 +253,37 @@ class TestMonthlyTotals:
         )
         assert totals.overspending == ZERO
         assert totals.to_be_assigned == AUD("411.12")
+
+    def test_units_match_amounts(self, spec):
+        totals = MonthlyTotals(
+            spec,
+            previous_tba=AUD("0.10"),
+            previous_holding=0,
+            previous_overspending=0,
+            funding=AUD("0.20"),
+            holding=0,
+            previous_carryover=CategoryMap(spec),
+            spending=CategoryMap.with_values(spec, {"rent": AUD("-0.30")}),
+            assigning=CategoryMap(spec),
+        )
+        assert totals.funding_units == 20
+        assert totals.spending_units["rent"] == -30
+        assert totals.to_be_assigned_units == 30
+        assert totals.to_be_assigned == AUD("0.30")
+        assert totals.category_balances["rent"] == AUD("-0.30")
+
+    def test_derived_amounts_materialised(self, spec):
+        totals = MonthlyTotals(
+            spec,
+            previous_tba=0,
+            previous_holding=0,
+            previous_overspending=0,
+            funding=AUD("10.00"),
+            holding=0,
+            previous_carryover=CategoryMap(spec),
+            spending=CategoryMap.with_values(spec, {"rent": AUD("-5.00")}),
+            assigning=CategoryMap(spec),
+        )
+        assert totals.overspending_units == -500
+        assert totals.category_balances is totals.category_balances
+        assert totals.to_be_assigned is totals.to_be_assigned
@@ -59,9 +59,84 @@ class TestBudgetIntegration:
             "investments"
         ] == AUD("100")
 
+    def test_category_update_matches_full_update(self, budget):
+        budget.update_assigned_amount(Month(12, 2024), "rent", AUD("10"), save=False)
+        budget.update_assigned_amount(Month(1, 2025), "car", AUD("0"), save=False)
+        column_totals = dict(budget.monthly_totals)
+        budget.update_monthly_totals()
+        assert column_totals == budget.monthly_totals
+
+    def test_absorbed_change_stops_early(self, budget):
+        # utilities is overspent in January, so a smaller assignment can't carry over
+        march = budget.monthly_totals[Month(3, 2025)]
+        budget.update_assigned_amount(Month(1, 2025), "utilities", AUD("5"), save=False)
+        assert budget.monthly_totals[Month(1, 2025)].overspending == AUD("-15")
+        assert budget.monthly_totals[Month(3, 2025)] is march
+
+        settled_totals = dict(budget.monthly_totals)
+        budget.update_monthly_totals()
+        assert settled_totals == budget.monthly_totals
+
+    def test_recalculation_yields_edited_month_first(self, budget):
+        budget.set_assigned_amount(Month(12, 2024), "rent", AUD("10"))
+        months = budget.recalculate(Month(12, 2024), "rent")
+        assert next(months) == Month(12, 2024)
+        assert budget.monthly_totals[Month(12, 2024)].assigning["rent"] == AUD("10")
+        assert list(months)[-1] == budget.latest_month
+
+    def test_superseded_recalculation_is_caught_up(self, budget):
+        budget.set_assigned_amount(Month(12, 2024), "rent", AUD("10"))
+        abandoned = budget.recalculate(Month(12, 2024), "rent")
+        assert next(abandoned) == Month(12, 2024)
+
+        # a later edit to another category still has to finish the rent column
+        budget.set_assigned_amount(Month(2, 2025), "car", AUD("1"))
+        months = list(budget.recalculate(Month(2, 2025), "car"))
+        assert months[0] == Month(1, 2025)
+        assert list(abandoned) == []
+
+        recalculated_totals = dict(budget.monthly_totals)
+        budget.update_monthly_totals()
+        assert recalculated_totals == budget.monthly_totals
+
+    def test_superseded_recalculation_reaches_later_edit(self, budget):
+        budget.set_assigned_amount(Month(1, 2025), "utilities", AUD("5"))
+        abandoned = budget.recalculate(Month(1, 2025), "utilities")
+        assert next(abandoned) == Month(1, 2025)
+
+        # catching up with the stale months mustn't settle before the new edit
+        budget.set_assigned_amount(Month(6, 2026), "car", AUD("40"))
+        months = list(budget.recalculate(Month(6, 2026), "car"))
+        assert Month(6, 2026) in months
+        assert budget.monthly_totals[Month(6, 2026)].assigning["car"] == AUD("40")
+
+        recalculated_totals = dict(budget.monthly_totals)
+        budget.update_monthly_totals()
+        assert recalculated_totals == budget.monthly_totals
+
     def test_held_changes_propagate(self, budget):
         budget.update_held_amount(Month(1, 2025), AUD("99.95"), save=False)
         assert budget.monthly_totals[Month(1, 2025)].holding == AUD("99.95")
         assert budget.monthly_totals[Month(1, 2025)].to_be_assigned == AUD("160.27")
         assert budget.monthly_totals[Month(2, 2025)].holding == ZERO
         assert budget.monthly_totals[Month(2, 2025)].to_be_assigned == AUD("240.02")
+
+    def test_edits_are_journalled(self, tmp_budget_path):
+        store_path = tmp_budget_path.parent / "sample-budget.json"
+        stored = store_path.read_text()
+        budget = Budget(tmp_budget_path)
+        budget.update_assigned_amount(Month(1, 2025), "car", AUD("12.34"))
+        assert store_path.read_text() == stored
+
+        reloaded = Budget(tmp_budget_path)
+        assert reloaded.monthly_totals == budget.monthly_totals
+        reloaded.compact_journal()
+        assert store_path.read_text() != stored
+        assert Budget(tmp_budget_path).monthly_totals == budget.monthly_totals
+
+    def test_directives_released_by_default(self, budget):
+        assert budget.beancount_directives is None
+
+    def test_keep_directives(self, data_dir):
+        budget = Budget(data_dir / "sample-budget.yml", keep_directives=True)
+        assert len(budget.beancount_directives) > 0
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from beanzero.budget.budget import Budget
+from beanzero.budget.spec import Month
+
+from .conftest import AUD, import_tx
+
+
+@pytest.fixture
+def cached_budget_path(tmp_budget_path):
+    with tmp_budget_path.open("a") as spec_f:
+        spec_f.write("cache: ./sample-budget.cache.json\n")
+    return tmp_budget_path
+
+
+class TestLedgerCache:
+    def test_cold_start_writes_cache(self, cached_budget_path, loader_calls):
+        budget = Budget(cached_budget_path)
+        assert budget.spec.cache.exists()
+        assert len(loader_calls) == 1
+
+    def test_warm_start_skips_loader(self, cached_budget_path, loader_calls):
+        cold = Budget(cached_budget_path)
+        warm = Budget(cached_budget_path)
+
+        assert len(loader_calls) == 1
+        assert warm.monthly_transactions == cold.monthly_transactions
+        jan = warm.monthly_totals[Month(1, 2025)]
+        assert jan.total_spending == AUD("-1678")
+        assert jan.to_be_assigned == AUD("260.22")
+
+    def test_ledger_change_invalidates(self, cached_budget_path, loader_calls):
+        Budget(cached_budget_path)
+        ledger = cached_budget_path.parent / "sample-budget.bean"
+        with ledger.open("a") as ledger_f:
+            ledger_f.write(
+                '\n2025-01-30 * "Cafe"\n'
+                "    Expenses:Eating-Out                    10.00 AUD\n"
+                "    Liabilities:Credit-Card               -10.00 AUD\n"
+            )
+        budget = Budget(cached_budget_path)
+        assert len(loader_calls) == 2
+        jan = budget.monthly_totals[Month(1, 2025)]
+        assert jan.total_spending == AUD("-1688")
+
+    def test_touched_ledger_still_fresh(self, cached_budget_path, loader_calls):
+        Budget(cached_budget_path)
+        # the content hash is checked when only the mtime differs
+        ledger = cached_budget_path.parent / "sample-budget.bean"
+        stat = ledger.stat()
+        os.utime(ledger, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        Budget(cached_budget_path)
+        assert len(loader_calls) == 1
+
+    def test_spec_change_invalidates(self, cached_budget_path, loader_calls):
+        Budget(cached_budget_path)
+        spec_text = cached_budget_path.read_text()
+        cached_budget_path.write_text(
+            spec_text.replace(
+                "accounts: Expenses:Hobbies",
+                "accounts: [Expenses:Hobbies, Expenses:Crafts]",
+            )
+        )
+        Budget(cached_budget_path)
+        assert len(loader_calls) == 2
+
+    def test_new_included_file_invalidates(self, glob_budget_path, loader_calls):
+        with glob_budget_path.open("a") as spec_f:
+            spec_f.write("cache: ./sample-budget.cache.json\n")
+        Budget(glob_budget_path)
+        (glob_budget_path.parent / "imports" / "b.bean").write_text(import_tx("20.00"))
+
+        budget = Budget(glob_budget_path)
+        assert len(loader_calls) == 2
+        feb = budget.monthly_totals[Month(2, 2025)]
+        assert feb.total_spending == AUD("-30.00")
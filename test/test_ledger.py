@@ -0,0 +1,77 @@
+import pytest
+
+from beanzero.budget.budget import Budget
+from beanzero.budget.spec import Month
+
+from .conftest import AUD, import_tx
+
+CAFE_TX = """
+2025-02-03 * "Cafe"
+    Expenses:Eating-Out                    10.00 AUD
+    Liabilities:Credit-Card
+"""
+
+
+@pytest.fixture
+def included_budget_path(tmp_budget_path):
+    root = tmp_budget_path.parent / "main.bean"
+    root.write_text('include "sample-budget.bean"\n')
+    spec_text = tmp_budget_path.read_text()
+    tmp_budget_path.write_text(spec_text.replace("./sample-budget.bean", "./main.bean"))
+    return tmp_budget_path
+
+
+def append_to(path, text):
+    with path.open("a") as f:
+        f.write(text)
+
+
+class TestLedgerReload:
+    def test_unchanged_ledger_is_noop(self, included_budget_path):
+        budget = Budget(included_budget_path)
+        assert budget.changed_ledger_files() == []
+        assert budget.reload_ledger() is None
+
+    def test_appended_file_reparsed_alone(self, included_budget_path, loader_calls):
+        budget = Budget(included_budget_path)
+        jan = budget.monthly_totals[Month(1, 2025)]
+        append_to(included_budget_path.parent / "sample-budget.bean", CAFE_TX)
+
+        assert budget.reload_ledger() == Month(2, 2025)
+        assert len(loader_calls) == 1
+        assert budget.monthly_totals[Month(1, 2025)] is jan
+        feb = budget.monthly_totals[Month(2, 2025)]
+        assert feb.total_spending == AUD("-10.00")
+        assert feb.category_balances["eating-out"] == AUD("45")
+
+    def test_root_change_reloads_fully(self, included_budget_path, loader_calls):
+        budget = Budget(included_budget_path)
+        append_to(included_budget_path.parent / "main.bean", CAFE_TX)
+
+        assert budget.reload_ledger() == Month(2, 2025)
+        assert len(loader_calls) == 2
+        feb = budget.monthly_totals[Month(2, 2025)]
+        assert feb.total_spending == AUD("-10.00")
+
+    def test_new_earliest_month(self, included_budget_path):
+        budget = Budget(included_budget_path)
+        append_to(
+            included_budget_path.parent / "sample-budget.bean",
+            CAFE_TX.replace("2025-02-03", "2024-11-03"),
+        )
+
+        assert budget.reload_ledger() == Month(11, 2024)
+        assert budget.ledger_start_month == Month(11, 2024)
+        nov = budget.monthly_totals[Month(11, 2024)]
+        assert nov.to_be_assigned == AUD("0")
+        assert nov.category_balances["eating-out"] == AUD("-10.00")
+
+    def test_new_included_file_reloads(self, glob_budget_path, loader_calls):
+        budget = Budget(glob_budget_path)
+        (glob_budget_path.parent / "imports" / "b.bean").write_text(import_tx("20.00"))
+
+        assert budget.reload_ledger() == Month(2, 2025)
+        assert len(loader_calls) == 2
+        feb = budget.monthly_totals[Month(2, 2025)]
+        assert feb.total_spending == AUD("-30.00")
+        assert budget.reload_ledger() is None
@@ -0,0 +1,78 @@
+import pytest
+
+from beanzero.budget.budget import Budget
+from beanzero.budget.spec import Month
+from beanzero.cli import main
+
+from .conftest import AUD, import_tx
+
+
+@pytest.fixture
+def snapshot_budget_path(tmp_budget_path):
+    with tmp_budget_path.open("a") as spec_f:
+        spec_f.write("snapshot: ./sample-budget.snapshot\n")
+    main(["compile", str(tmp_budget_path)])
+    return tmp_budget_path
+
+
+class TestBudgetSnapshot:
+    def test_fresh_snapshot_skips_loader(self, snapshot_budget_path, loader_calls):
+        budget = Budget(snapshot_budget_path)
+        assert len(loader_calls) == 0
+        assert budget._snapshot is not None
+        jan = budget.monthly_totals[Month(1, 2025)]
+        assert jan.total_spending == AUD("-1678")
+        assert jan.to_be_assigned == AUD("260.22")
+
+    def test_matches_calculated_totals(self, snapshot_budget_path, data_dir):
+        budget = Budget(snapshot_budget_path)
+        original = Budget(data_dir / "sample-budget.yml")
+        assert budget.ledger_start_month == original.ledger_start_month
+        assert budget.latest_month == original.latest_month
+        for month, totals in original.monthly_totals.items():
+            snapshot_totals = budget.monthly_totals[month]
+            assert snapshot_totals.category_balances == totals.category_balances
+            assert snapshot_totals.to_be_assigned == totals.to_be_assigned
+            assert snapshot_totals.holding == totals.holding
+
+    def test_edit_loads_in_full(self, snapshot_budget_path, loader_calls):
+        budget = Budget(snapshot_budget_path)
+        budget.update_assigned_amount(Month(1, 2025), "car", AUD("0"), save=False)
+        assert len(loader_calls) == 1
+        assert budget._snapshot is None
+        jan = budget.monthly_totals[Month(1, 2025)]
+        assert jan.category_balances["car"] == AUD("-480")
+
+    def test_store_change_invalidates(self, snapshot_budget_path, loader_calls):
+        Budget(snapshot_budget_path).update_assigned_amount(
+            Month(1, 2025), "car", AUD("0")
+        )
+        budget = Budget(snapshot_budget_path)
+        assert budget._snapshot is None
+        assert budget.monthly_totals[Month(1, 2025)].category_balances["car"] == AUD(
+            "-480"
+        )
+
+    def test_ledger_change_reloads(self, snapshot_budget_path, loader_calls):
+        budget = Budget(snapshot_budget_path)
+        with (snapshot_budget_path.parent / "sample-budget.bean").open("a") as f:
+            f.write(
+                '\n2025-01-30 * "Cafe"\n'
+                "    Expenses:Eating-Out                    10.00 AUD\n"
+                "    Liabilities:Credit-Card               -10.00 AUD\n"
+            )
+        assert budget.reload_ledger() == Month(12, 2024)
+        assert budget._snapshot is None
+        assert budget.monthly_totals[Month(1, 2025)].total_spending == AUD("-1688")
+
+    def test_new_included_file_invalidates(self, glob_budget_path, loader_calls):
+        with glob_budget_path.open("a") as spec_f:
+            spec_f.write("snapshot: ./sample-budget.snapshot\n")
+        main(["compile", str(glob_budget_path)])
+        assert Budget(glob_budget_path)._snapshot is not None
+        (glob_budget_path.parent / "imports" / "b.bean").write_text(import_tx("20.00"))
+
+        budget = Budget(glob_budget_path)
+        assert budget._snapshot is None
+        feb = budget.monthly_totals[Month(2, 2025)]
+        assert feb.total_spending == AUD("-30.00")
@@ -1,10 +1,13 @@
+import copy
+import io
 from decimal import Decimal
 
 import beancount as b
 import beancount.core.amount as amt
 import pytest
+import yaml
 
-from beanzero.budget.spec import CategoryMap, Month
+from beanzero.budget.spec import BudgetSpec, CategoryMap, Month
 
 from .conftest import AUD, ZERO
 
@@ -57,6 +60,22 @@ class TestMonth:
         m = Month(12, 1999)
         assert m.from_string(m.as_iso()) == m
 
+    def test_months_interned(self):
+        assert Month(12, 1999) + 1 is Month(1, 2000)
+        assert Month.from_string("2000-01") is Month(1, 2000) - 0
+        assert copy.deepcopy(Month(1, 2000)) is Month(1, 2000)
+        with pytest.raises(AttributeError):
+            Month(1, 2000).month = 2
+
+    def test_month_range(self):
+        assert list(Month.range(Month(11, 1999), Month(2, 2000))) == [
+            Month(11, 1999),
+            Month(12, 1999),
+            Month(1, 2000),
+            Month(2, 2000),
+        ]
+        assert list(Month.range(Month(2, 2000), Month(1, 2000))) == []
+
 
 @pytest.mark.spec_file("sample-budget.yml")
 class TestNormalBudgetSpec:
@@ -85,6 +104,17 @@ class TestNormalBudgetSpec:
         assert spec.get_account_category("Assets:Savings") is None
         assert spec.get_account_category("Expenses:Off-Budget") is None
 
+    def test_account_roles(self, spec):
+        checking = spec.account_role("Assets:Checking")
+        assert checking.budget_account and checking.category is None
+        rent = spec.account_role("Expenses:Rent")
+        assert not rent.budget_account and rent.category == "rent"
+        irrelevant = spec.account_role("Income:Salary")
+        assert not irrelevant.budget_account and irrelevant.category is None
+
+    def test_account_roles_memoised(self, spec):
+        assert spec.account_role("Expenses:New") is spec.account_role("Expenses:New")
+
     def test_all_category_keys(self, spec):
         assert spec.all_category_keys == [
             "rent",
@@ -109,6 +139,15 @@ class TestNormalBudgetSpec:
             amt.Amount(Decimal("999.999"), "AUD")
         )
 
+    def test_units_roundtrip(self, spec):
+        assert spec.to_units(AUD("1000.12")) == 100012
+        assert spec.to_units(AUD("-3")) == -300
+        assert spec.from_units(100012) == AUD("1000.12")
+        with pytest.raises(ValueError):
+            spec.to_units(AUD("999.999"))
+        with pytest.raises(ValueError):
+            spec.to_units(b.Amount(b.D("20"), "EUR"))
+
     def test_currency_formatting(self, spec):
         assert (
             spec.format_currency(amt.Amount(Decimal("1123.45"), "AUD")) == "$1,123.45"
@@ -117,6 +156,91 @@ class TestNormalBudgetSpec:
             spec.format_currency(amt.Amount(Decimal("-1123.45"), "AUD")) == "-$1,123.45"
         )
 
+    def test_currency_formatter_cached(self, spec):
+        formatter = spec.currency_formatter
+        assert spec.currency_formatter is formatter
+        formatter.format_number.cache_clear()
+        assert spec.format_currency(AUD("5"), symbol_override=False) == "5.00"
+        assert spec.format_currency(AUD("5.00"), symbol_override=False) == "5.00"
+        assert formatter.format_number.cache_info().hits == 1
+        with pytest.raises(ValueError):
+            spec.format_currency(AUD("5.001"))
+
+    def test_currency_formatter_keeps_negative_zero(self, spec):
+        spec.currency_formatter.format_number.cache_clear()
+        assert spec.format_currency(AUD("0.00")) == "$0.00"
+        assert spec.format_currency(AUD("-0.00")) == "-$0.00"
+        assert spec.format_currency(AUD("0")) == "$0.00"
+
+
+def load_spec(data_dir, categories, accounts=["Assets:*", "Liabilities:Credit-Card"]):
+    data = {
+        "ledger": str(data_dir / "sample-budget.bean"),
+        "storage": str(data_dir / "sample-budget.json"),
+        "currency": "AUD",
+        "accounts": accounts,
+        "groups": [
+            {
+                "name": "Group",
+                "categories": [
+                    {"name": name, "accounts": patterns}
+                    for name, patterns in categories.items()
+                ],
+            }
+        ],
+    }
+    return BudgetSpec.load(io.StringIO(yaml.safe_dump(data)))
+
+
+class TestAccountPatterns:
+    def test_prefix_covers_descendants(self, data_dir):
+        spec = load_spec(data_dir, {"Car": ["Expenses:Car"]})
+        assert spec.get_account_category("Expenses:Car") == "car"
+        assert spec.get_account_category("Expenses:Car:Petrol") == "car"
+        assert spec.get_account_category("Expenses:Car:Petrol:Premium") == "car"
+        assert spec.get_account_category("Expenses:Cars") is None
+        assert spec.get_account_category("Expenses") is None
+
+    def test_globs(self, data_dir):
+        spec = load_spec(
+            data_dir,
+            {"Fees": ["Expenses:Bank*:Fees"], "Insurance": ["Expenses:Insurance-*"]},
+        )
+        assert spec.get_account_category("Expenses:Bank:Fees") == "fees"
+        assert spec.get_account_category("Expenses:Bank:Fees:Overdraft") == "fees"
+        assert spec.get_account_category("Expenses:Bank:Interest") is None
+        assert spec.get_account_category("Expenses:Shop:Fees") is None
+        assert spec.get_account_category("Expenses:Insurance-Car") == "insurance"
+        assert spec.is_budget_acccount("Assets:Checking")
+        assert not spec.is_budget_acccount("Liabilities:Mortgage")
+
+    @pytest.mark.parametrize(
+        "categories",
+        [
+            {"Food": ["Expenses:Food"], "Other": ["Expenses:Food"]},
+            {"Car": ["Expenses:Car"], "Petrol": ["Expenses:Car:Petrol"]},
+            {"Car": ["Expenses:Car*"], "Petrol": ["Expenses:*:Petrol"]},
+            {"Fees": ["Expenses:*:Fees"], "Insurance": ["Expenses:Insurance-*"]},
+        ],
+    )
+    def test_overlapping_categories(self, data_dir, categories):
+        # cattrs collects validation errors into an exception group
+        with pytest.raises(ExceptionGroup) as excinfo:
+            load_spec(data_dir, categories)
+        assert excinfo.group_contains(ValueError, match="multiple categories")
+
+    def test_disjoint_globs(self, data_dir):
+        spec = load_spec(
+            data_dir, {"Car": ["Expenses:Car*"], "Food": ["Expenses:Food*"]}
+        )
+        assert spec.get_account_category("Expenses:Cars") == "car"
+        assert spec.get_account_category("Expenses:Foods") == "food"
+
+    def test_budget_account_overlap(self, data_dir):
+        with pytest.raises(ExceptionGroup) as excinfo:
+            load_spec(data_dir, {"Investments": ["Assets:Investments"]})
+        assert excinfo.group_contains(ValueError, match="budget accounts")
+
 
 @pytest.mark.spec_file("sample-budget.yml")
 class TestCategoryMap:
@@ -154,3 +278,19 @@ class TestCategoryMap:
     def test_reject_bad_currency(self, spec):
         with pytest.raises(ValueError):
             spec.category_map()["car"] = b.Amount(b.D("20"), "EUR")
+
+    def test_keys_in_category_order(self, spec):
+        m = spec.category_map()
+        assert list(m) == spec.all_category_keys
+        assert len(m) == len(spec.all_category_keys)
+        assert "car" in m and "not-real" not in m
+
+    def test_equals_plain_dict(self, spec):
+        m = CategoryMap.with_values(spec, {"car": AUD("200")})
+        assert m == {k: AUD("200") if k == "car" else ZERO for k in m}
+        assert m != spec.category_map()
+
+    def test_reject_deleting_keys(self, spec):
+        m = spec.category_map()
+        with pytest.raises(TypeError):
+            del m["car"]
@@ -1,10 +1,23 @@
+import io
+import json
 from collections import defaultdict
 
 import beancount as b
 import pytest
 
-from beanzero.budget.spec import Month
-from beanzero.budget.store import AssignedAmounts
+from beanzero.budget.budget import Budget
+from beanzero.budget.spec import BudgetSpec, Month
+from beanzero.budget.store import (
+    AssignedAmounts,
+    BudgetStore,
+    SHARD_CACHE_SIZE,
+    SqliteBudgetStore,
+    get_store_converter,
+    journal_path,
+    migrate_store,
+    open_store,
+)
+from beanzero.cli import main
 
 from .conftest import AUD, ZERO
 
@@ -42,7 +55,18 @@ class TestBudgetStore:
         with pytest.raises(KeyError):
             assert store.assigned[Month(1, 1999)].categories["non-existent"]
 
-    # TODO do round trip testing that checks zero values aren't written
+    def test_save_roundtrip(self, store, spec, tmp_path):
+        store.assigned[Month(1, 1999)].categories["car"] = AUD("50.00")
+        store.assigned[Month(1, 2025)].categories["car"] = ZERO
+        path = tmp_path / "budget.json"
+        store.save(path, spec)
+
+        data = json.loads(path.read_text())
+        assert list(data["assigned"].keys()) == sorted(data["assigned"].keys())
+        assert "car" not in data["assigned"]["2025-01"]["categories"]
+        with path.open("r") as store_f:
+            assert BudgetStore.load(store_f, spec).assigned == store.assigned
+
     @pytest.mark.xfail(
         reason="defaultdict->CategoryMap means zeroes are pruned only on write"
     )
@@ -56,3 +80,253 @@ class TestBudgetStore:
         store.assigned[Month(1, 1999)] = AssignedAmounts(spec.zero, spec.category_map())
         store.prune()
         assert Month(1, 1999) not in store.assigned.keys()
+
+
+@pytest.mark.spec_file("sample-budget.yml")
+class TestJournal:
+    @pytest.fixture
+    def store_path(self, tmp_budget_path):
+        return tmp_budget_path.parent / "sample-budget.json"
+
+    def load_store(self, path, spec):
+        with path.open("r") as store_f:
+            store = BudgetStore.load(store_f, spec)
+        store.replay_journal(path)
+        return store
+
+    def test_replays_edits(self, store_path, spec):
+        store = self.load_store(store_path, spec)
+        store.append_journal(store_path, [(Month(1, 2025), "car", AUD("12.34"))])
+        store.append_journal(store_path, [(Month(3, 2025), None, AUD("5.00"))])
+        store.append_journal(store_path, [(Month(1, 2025), "car", AUD("56.78"))])
+
+        replayed = self.load_store(store_path, spec)
+        assert replayed.journal_records == 3
+        assert replayed.assigned[Month(1, 2025)].categories["car"] == AUD("56.78")
+        assert replayed.assigned[Month(3, 2025)].held == AUD("5.00")
+
+    def test_ignores_torn_write(self, store_path, spec):
+        store = self.load_store(store_path, spec)
+        store.append_journal(store_path, [(Month(1, 2025), "car", AUD("12.34"))])
+        with journal_path(store_path).open("a") as journal_f:
+            journal_f.write('{"month":"2025-01","cat')
+
+        replayed = self.load_store(store_path, spec)
+        assert replayed.assigned[Month(1, 2025)].categories["car"] == AUD("12.34")
+        replayed.append_journal(store_path, [(Month(1, 2025), "car", AUD("56.78"))])
+        replayed = self.load_store(store_path, spec)
+        assert replayed.assigned[Month(1, 2025)].categories["car"] == AUD("56.78")
+
+    def test_keeps_record_missing_newline(self, store_path, spec):
+        store = self.load_store(store_path, spec)
+        store.append_journal(store_path, [(Month(1, 2025), "car", AUD("12.34"))])
+        journal = journal_path(store_path)
+        journal.write_bytes(journal.read_bytes().rstrip(b"\n"))
+
+        replayed = self.load_store(store_path, spec)
+        assert replayed.assigned[Month(1, 2025)].categories["car"] == AUD("12.34")
+        replayed.append_journal(store_path, [(Month(3, 2025), None, AUD("5.00"))])
+        replayed = self.load_store(store_path, spec)
+        assert replayed.journal_records == 2
+        assert replayed.assigned[Month(1, 2025)].categories["car"] == AUD("12.34")
+        assert replayed.assigned[Month(3, 2025)].held == AUD("5.00")
+
+    def test_rejects_malformed_record(self, store_path, spec):
+        store = self.load_store(store_path, spec)
+        store.append_journal(store_path, [(Month(1, 2025), "car", AUD("12.34"))])
+        with journal_path(store_path).open("a") as journal_f:
+            journal_f.write('{"month":"2025-01","cat\n')
+        store.append_journal(store_path, [(Month(1, 2025), "car", AUD("56.78"))])
+
+        with pytest.raises(ValueError, match="line 2"):
+            self.load_store(store_path, spec)
+
+    def test_rejects_unknown_category(self, store_path, spec):
+        store = self.load_store(store_path, spec)
+        store.append_journal(store_path, [(Month(1, 2025), "boat", AUD("12.34"))])
+
+        with pytest.raises(ValueError, match="non-existent category 'boat'"):
+            self.load_store(store_path, spec)
+
+    def test_save_compacts_journal(self, store_path, spec):
+        store = self.load_store(store_path, spec)
+        store.set_amount(Month(1, 2025), "car", AUD("12.34"))
+        store.append_journal(store_path, [(Month(1, 2025), "car", AUD("12.34"))])
+        store.save(store_path, spec)
+
+        assert not journal_path(store_path).exists()
+        assert store.journal_records == 0
+        saved = self.load_store(store_path, spec)
+        assert saved.assigned[Month(1, 2025)].categories["car"] == AUD("12.34")
+
+
+@pytest.mark.spec_file("sample-budget.yml")
+class TestSqliteStore:
+    @pytest.fixture
+    def sqlite_budget_path(self, tmp_budget_path):
+        sqlite_path = tmp_budget_path.parent / "sample-budget.sqlite"
+        main(["migrate", str(tmp_budget_path), str(sqlite_path)])
+        spec_text = tmp_budget_path.read_text()
+        tmp_budget_path.write_text(
+            spec_text.replace("sample-budget.json", "sample-budget.sqlite")
+        )
+        return tmp_budget_path
+
+    def test_migrated_budget_matches(self, sqlite_budget_path, data_dir):
+        budget = Budget(sqlite_budget_path)
+        original = Budget(data_dir / "sample-budget.yml")
+        assert isinstance(budget._store, SqliteBudgetStore)
+        assert budget.monthly_totals.keys() == original.monthly_totals.keys()
+        for month, totals in budget.monthly_totals.items():
+            assert totals.assigning == original.monthly_totals[month].assigning
+            assert totals.holding == original.monthly_totals[month].holding
+
+    def test_loads_months_lazily(self, sqlite_budget_path):
+        spec = BudgetSpec.load_path(sqlite_budget_path)
+        store = open_store(spec)
+        assert list(store.assigned.keys()) == [
+            Month(12, 2024),
+            Month(1, 2025),
+            Month(2, 2025),
+        ]
+        assert store.assigned.loaded == {}
+        assert store.assigned[Month(1, 2025)].categories["car"] == AUD("500.00")
+        assert list(store.assigned.loaded.keys()) == [Month(1, 2025)]
+        assert store.assigned[Month(1, 1999)].held == ZERO
+        assert Month(1, 1999) not in store.assigned
+
+    def test_edits_written_to_rows(self, sqlite_budget_path):
+        budget = Budget(sqlite_budget_path)
+        budget.update_assigned_amount(Month(1, 2025), "car", AUD("12.34"))
+        budget.update_assigned_amount(Month(1, 2025), "hobbies", ZERO)
+        budget.update_held_amount(Month(3, 2025), AUD("5.00"))
+
+        reloaded = Budget(sqlite_budget_path)
+        assert reloaded.monthly_totals == budget.monthly_totals
+        assigned = reloaded._store.assigned
+        assert assigned[Month(1, 2025)].categories["car"] == AUD("12.34")
+        assert assigned[Month(1, 2025)].categories["hobbies"] == ZERO
+        assert assigned[Month(3, 2025)].held == AUD("5.00")
+
+    def test_counts_unsaved_months(self, sqlite_budget_path):
+        spec = BudgetSpec.load_path(sqlite_budget_path)
+        store = open_store(spec)
+        store.set_amount(Month(1, 2026), "car", AUD("12.34"))
+        store.set_amount(Month(2, 2025), None, ZERO)
+        for category in spec.all_category_keys:
+            store.set_amount(Month(2, 2025), category, ZERO)
+
+        assert Month(1, 2026) in store.assigned
+        assert Month(2, 2025) not in store.assigned
+        assert list(store.assigned) == [Month(12, 2024), Month(1, 2025), Month(1, 2026)]
+        assert store.latest_month() == Month(1, 2026)
+
+    def test_editing_latest_month_extends_totals(self, sqlite_budget_path):
+        budget = Budget(sqlite_budget_path)
+        month = budget.latest_month
+        budget.set_assigned_amount(month, "car", AUD("12.34"))
+        for _ in budget.recalculate(month, "car"):
+            pass
+        budget.journal_amounts([(month, "car", AUD("12.34"))])
+
+        # as when navigating forward to the new latest month
+        assert budget.latest_month == month + 1
+        assert budget.totals_for(month + 1) is not None
+
+    def test_migrates_back_to_json(self, sqlite_budget_path, data_dir):
+        spec = BudgetSpec.load_path(sqlite_budget_path)
+        json_path = sqlite_budget_path.parent / "roundtrip.json"
+        migrate_store(spec, spec.storage, json_path)
+        with json_path.open("r") as store_f:
+            roundtrip = BudgetStore.load(store_f, spec)
+        with (data_dir / "sample-budget.json").open("r") as store_f:
+            original = BudgetStore.load(store_f, spec)
+        assert roundtrip.assigned == original.assigned
+
+    def test_wont_overwrite(self, sqlite_budget_path):
+        spec = BudgetSpec.load_path(sqlite_budget_path)
+        with pytest.raises(ValueError):
+            migrate_store(spec, spec.storage, spec.storage)
+
+
+@pytest.mark.spec_file("sample-budget.yml")
+class TestShardedStore:
+    @pytest.fixture
+    def sharded_budget_path(self, tmp_budget_path):
+        with tmp_budget_path.open("a") as spec_f:
+            spec_f.write("storage_layout: yearly\n")
+        return tmp_budget_path
+
+    def test_splits_single_store(self, sharded_budget_path, data_dir):
+        budget = Budget(sharded_budget_path)
+        shards = sorted(p.name for p in sharded_budget_path.parent.glob("*.20*.json"))
+        assert shards == ["sample-budget.2024.json", "sample-budget.2025.json"]
+
+        original = Budget(data_dir / "sample-budget.yml")
+        for month, totals in original.monthly_totals.items():
+            assert budget.monthly_totals[month].assigning == totals.assigning
+            assert budget.monthly_totals[month].holding == totals.holding
+
+    def test_loads_shards_lazily(self, sharded_budget_path):
+        spec = BudgetSpec.load_path(sharded_budget_path)
+        open_store(spec)
+        store = open_store(spec)
+        assert store.years == {2024, 2025}
+        assert store.shards == {}
+        assert store.assigned[Month(1, 2025)].categories["car"] == AUD("500.00")
+        assert store.shards.keys() == {2025}
+        assert store.latest_month() == Month(2, 2025)
+
+    def test_keeps_only_recent_shards(self, sharded_budget_path):
+        Budget(sharded_budget_path)
+        budget = Budget(sharded_budget_path)
+        assert len(budget._store.shards) <= SHARD_CACHE_SIZE
+
+        budget.update_assigned_amount(Month(12, 2024), "car", AUD("12.34"))
+        budget.save()
+        store = open_store(budget.spec)
+        assert store.assigned[Month(12, 2024)].categories["car"] == AUD("12.34")
+        assert store.assigned[Month(1, 2025)].categories["car"] == AUD("500.00")
+
+    def test_saves_dirty_shards(self, sharded_budget_path):
+        budget = Budget(sharded_budget_path)
+        shard_2024 = sharded_budget_path.parent / "sample-budget.2024.json"
+        shard_2024.write_text("not read again")
+        budget.update_assigned_amount(Month(3, 2025), "car", AUD("12.34"))
+        budget.update_held_amount(Month(1, 2026), AUD("5.00"))
+        budget.save()
+
+        assert shard_2024.read_text() == "not read again"
+        assert (sharded_budget_path.parent / "sample-budget.2026.json").exists()
+        store = open_store(budget.spec)
+        assert store.assigned[Month(3, 2025)].categories["car"] == AUD("12.34")
+        assert store.assigned[Month(1, 2026)].held == AUD("5.00")
+
+    def test_clearing_everything_stays_cleared(self, sharded_budget_path):
+        budget = Budget(sharded_budget_path)
+        for month in list(budget._store.assigned.keys()):
+            budget.update_held_amount(month, ZERO, save=False)
+            for category in budget.spec.all_category_keys:
+                budget.update_assigned_amount(month, category, ZERO, save=False)
+        budget.save()
+
+        store = open_store(budget.spec)
+        assert store.latest_month() is None
+        assert store.assigned[Month(1, 2025)].categories["car"] == ZERO
+
+
+@pytest.mark.spec_file("sample-budget.yml")
+def test_rejects_unknown_categories(spec):
+    data = '{"assigned": {"2025-01": {"held": "0", "categories": {"fake": "1.00"}}}}'
+    with pytest.raises(ValueError, match="non-existent category 'fake'"):
+        BudgetStore.load(io.StringIO(data), spec)
+
+
+def test_converter_bound_to_its_own_spec(data_dir):
+    first = BudgetSpec.load_path(data_dir / "sample-budget.yml")
+    second = BudgetSpec.load_path(data_dir / "sample-budget.yml")
+    assert get_store_converter(first) is get_store_converter(first)
+    assert get_store_converter(second) is not get_store_converter(first)
+
+    store = open_store(second)
+    assert store.assigned[Month(1, 2025)].categories._spec is second
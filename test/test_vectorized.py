@@ -0,0 +1,45 @@
+import pytest
+
+from beanzero.budget.budget import Budget
+from beanzero.budget.spec import Month
+
+from .conftest import AUD
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def budgets(tmp_budget_path):
+    """The same budget calculated with the python and numpy engines."""
+    numpy_path = tmp_budget_path.with_name("numpy-budget.yml")
+    numpy_path.write_text(tmp_budget_path.read_text() + "engine: numpy\n")
+    return Budget(tmp_budget_path), Budget(numpy_path)
+
+
+def assert_same_totals(expected, budget):
+    assert budget.monthly_totals.keys() == expected.monthly_totals.keys()
+    for month, totals in expected.monthly_totals.items():
+        actual = budget.monthly_totals[month]
+        assert actual.previous_tba == totals.previous_tba
+        assert actual.previous_holding == totals.previous_holding
+        assert actual.previous_overspending == totals.previous_overspending
+        assert actual.funding == totals.funding
+        assert actual.holding == totals.holding
+        assert actual.spending == totals.spending
+        assert actual.assigning == totals.assigning
+        assert actual.category_balances == totals.category_balances
+        assert actual.overspending == totals.overspending
+        assert actual.to_be_assigned == totals.to_be_assigned
+
+
+class TestVectorizedEngine:
+    def test_matches_python_engine(self, budgets):
+        expected, budget = budgets
+        assert budget.spec.engine == "numpy"
+        assert_same_totals(expected, budget)
+
+    def test_matches_after_updates(self, budgets):
+        for b in budgets:
+            b.update_assigned_amount(Month(1, 2025), "utilities", AUD("5"), save=False)
+            b.update_held_amount(Month(12, 2024), AUD("20"), save=False)
+        assert_same_totals(*budgets)